@@ -0,0 +1,68 @@
+'''
+Import time budget of the numerical core
+
+Imports fem.setup in fresh interpreters and fails (exit status 1) if it
+loads matplotlib or PySide, or if the import takes longer than the budget.
+The overhead over importing numpy and scipy.sparse alone is also checked,
+as that is the part fem itself is responsible for.
+
+Run from the repository root:
+python -m bench.import_time [--budget 2.0] [--overhead 0.25] [--repeat 5]
+'''
+import argparse
+import subprocess
+import sys
+
+PROBE = '''
+import sys, time
+t = time.perf_counter()
+import %s
+t = time.perf_counter()-t
+heavy = [m for m in sys.modules if m.split('.')[0] in ('matplotlib', 'PySide', 'PySide2', 'PySide6')]
+print(t, ','.join(sorted(heavy)))
+'''
+
+def import_time(modules, repeat):
+    '''
+    Best time of repeat fresh imports and the heavy modules loaded
+    '''
+    best = None
+    heavy = ''
+    for _ in range(repeat):
+        out = subprocess.check_output([sys.executable, '-c', PROBE % modules],
+                                      universal_newlines=True).split(' ', 1)
+        t = float(out[0])
+        heavy = out[1].strip()
+        best = t if best is None else min(best, t)
+    return best, heavy
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--budget', type=float, default=2.0,
+                        help="seconds allowed for import fem.setup")
+    parser.add_argument('--overhead', type=float, default=0.25,
+                        help="seconds allowed over numpy and scipy.sparse")
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    base, _ = import_time('numpy, scipy.sparse', args.repeat)
+    t, heavy = import_time('fem.setup', args.repeat)
+    print("import numpy, scipy.sparse: %.3f s" % base)
+    print("import fem.setup:           %.3f s (budget %.3f s)" % (t, args.budget))
+    print("overhead:                   %.3f s (budget %.3f s)" % (t-base, args.overhead))
+    ok = True
+    if heavy:
+        print("FAIL: fem.setup imports", heavy)
+        ok = False
+    if t > args.budget:
+        print("FAIL: over the import time budget")
+        ok = False
+    if t-base > args.overhead:
+        print("FAIL: over the overhead budget")
+        ok = False
+    print("OK" if ok else "FAILED")
+    return 0 if ok else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,84 @@
+'''
+Error against the number of unknowns and the wall time for linear (P1)
+and quadratic (P2) elements on the same sequence of meshes
+
+coaxial: axisymmetric, cylinders at r=4 (1 V) and r=60 (0 V), the exact
+potential is ln(60/r)/ln(15)
+plates: planar, two plates with corners, compared with P2 on the
+finest mesh with half the step. The field is singular at the corners,
+which limits both orders to about the same rate on uniform meshes
+
+The electrode edges are on the grid lines of every step, so the
+geometry is the same on all meshes. The error is the largest
+difference at a set of probe points away from the electrodes.
+
+Run from the repository root:
+python -m bench.p2 [--steps 4 2 1 0.5]
+'''
+import argparse
+import contextlib
+import io
+import time
+
+import numpy as np
+
+from fem.geometry import Geometry
+from fem.mesh import Mesh
+from fem.setup import Setup
+from fem.quadratic import QuadraticMesh, QuadraticSetup
+
+def coaxial():
+    geom = Geometry(0, 64, 0, 64)
+    geom.add_rectangular(0, -8, 4, 72, 1)
+    geom.add_rectangular(60, -8, 72, 72, 0)
+    xs, ys = np.meshgrid(np.linspace(6, 58, 14), np.linspace(10, 54, 5))
+    return geom, True, xs.ravel(), ys.ravel()
+
+def plates():
+    geom = Geometry(0, 64, 0, 64)
+    geom.add_rectangular(16, 16, 24, 48, 1)
+    geom.add_rectangular(40, 16, 48, 48, -1)
+    xs, ys = np.meshgrid(np.linspace(4, 60, 8), np.linspace(4, 60, 8))
+    keep = ~geom.electrode_mask(xs, ys)[0]
+    return geom, False, xs[keep], ys[keep]
+
+def run(geom, is_axisym, step, order):
+    with contextlib.redirect_stdout(io.StringIO()):
+        t = time.time()
+        mesh = Mesh(geom, step, step)
+        mesh.generate_mesh()
+        if order == 2:
+            setup = QuadraticSetup(QuadraticMesh(mesh))
+        else:
+            setup = Setup(mesh)
+        setup.init_system_mat(is_axisym, sparse=True)
+        setup.boundary_conditions()
+        t_setup = time.time()-t
+        t = time.time()
+        setup.solve(3)
+        t_solve = time.time()-t
+    return setup, t_setup, t_solve
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--steps', type=float, nargs='+', default=[4, 2, 1, 0.5])
+    args = parser.parse_args()
+
+    print("%-8s %5s %6s %9s %9s %9s %10s" %
+          ("case", "order", "step", "unknowns", "setup s", "solve s", "error"))
+    for name, case in (('coaxial', coaxial), ('plates', plates)):
+        geom, is_axisym, xs, ys = case()
+        if name == 'coaxial':
+            exact = np.log(60/xs)/np.log(15)
+        else:
+            exact = run(geom, is_axisym, min(args.steps)/2, 2)[0].probe_many(xs, ys)
+        for order in (1, 2):
+            for step in args.steps:
+                setup, t_setup, t_solve = run(geom, is_axisym, step, order)
+                error = abs(setup.probe_many(xs, ys)-exact).max()
+                print("%-8s %5d %6g %9d %9.3f %9.3f %10.2e" %
+                      (name, order, step, len(setup.free), t_setup, t_solve, error))
+
+if __name__ == '__main__':
+    main()
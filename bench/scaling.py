@@ -0,0 +1,260 @@
+'''
+Scaling of every pipeline stage with the mesh size
+
+For each case and step the stages are timed separately: mesh
+(Mesh.generate_mesh), assemble and boundary (Setup.init_system_mat and
+boundary_conditions, per matrix storage), solve (per solver of
+Controller.solvers, by default all but the pure python elimination),
+probe_u (a loop of single points) and probe_many (a grid of points).
+Every stage is run --repeat times on fresh objects and the best wall and
+CPU time is kept; the peak memory above the start of the stage (numpy and
+python allocations, with tracemalloc) is measured in one more run, so the
+tracking does not slow down the timed ones.
+
+Cases:
+circle: the circle of Controller.start in the default limits
+electrodes: 36 circles and rectangles at different potentials
+axisym: axisymmetric, a rod on the axis with a ring around it
+
+The empirical complexity is the least squares slope of log(wall time)
+against log(nodes), fitted per case and stage over the times above 1 ms.
+The results are written as JSON (-o), with the versions, the platform and
+the git revision. --compare old.json prints the ratios of the wall times
+and the change of the exponents against an earlier run.
+
+Run from the repository root:
+python -m bench.scaling [--steps 4 2 1] [--cases circle axisym] [-o scaling.json]
+'''
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+
+import numpy as np
+import scipy
+
+import fem.util as util
+from bench.solvers import MAX_DENSE, MAX_GAUSSIAN
+from fem.controller import Controller
+from fem.geometry import Geometry
+from fem.mesh import Mesh
+from fem.setup import Setup
+
+FORMAT = 1
+PROBE_POINTS = 200 # single point probes
+PROBE_GRID = 300 # probe_many on a PROBE_GRID x PROBE_GRID grid
+MIN_FIT_TIME = 1e-3
+
+def circle():
+    geom = Geometry()
+    geom.add_circular(-20, 0, 10, 1)
+    return geom, False
+
+def electrodes():
+    geom = Geometry()
+    for i in range(6):
+        for j in range(6):
+            x, y = -75+30*i, -75+30*j
+            u = (-1)**(i+j)*(1+(i*6+j) % 5)
+            if (i+j) % 2:
+                geom.add_circular(x, y, 8, u)
+            else:
+                geom.add_rectangular(x-6, y-6, x+6, y+6, u)
+    return geom, False
+
+def axisym():
+    geom = Geometry(0, 200, -100, 100)
+    geom.add_rectangular(0, -60, 5, 60, 1)
+    geom.add_circular(80, 0, 15, -1)
+    return geom, True
+
+cases = {'circle': circle, 'electrodes': electrodes, 'axisym': axisym}
+
+def measure(fn, memory=False):
+    '''
+    Result of fn() and the record of its phase: wall, cpu, peak_bytes
+    and the counters of the phases inside it
+    '''
+    with util.Profiler(memory) as prof:
+        with util.phase('stage'):
+            result = fn()
+    record = prof.records[-1]
+    counters = {}
+    for r in prof.records[:-1]:
+        for key, value in r['counters'].items():
+            counters[key] = counters.get(key, 0)+value
+    record['counters'] = counters
+    return result, record
+
+def solvers_for(num_nodes, indices):
+    out = []
+    for i in indices:
+        name, storage, method, options = Controller.solvers[i]
+        if storage == 'dense' and num_nodes > MAX_DENSE:
+            continue
+        if method == 1 and num_nodes > MAX_GAUSSIAN:
+            continue
+        out.append((name, storage, method, options))
+    return out
+
+def run_once(geom, is_axisym, step, solver_indices, memory):
+    '''
+    One run of all stages, a list of (stage, variant, record)
+    '''
+    rows = []
+    def add(stage, variant, fn):
+        result, record = measure(fn, memory)
+        rows.append((stage, variant, record))
+        return result
+
+    mesh = Mesh(geom, step, step)
+    add('mesh', '', mesh.generate_mesh)
+    done = set()
+    setup = None
+    for name, storage, method, options in solvers_for(len(mesh.coords), solver_indices):
+        setup = Setup(mesh)
+        def assemble():
+            setup.init_system_mat(is_axisym, storage != 'dense', storage == 'matrix-free')
+        # the system is the same for the solvers with the same storage
+        if storage not in done:
+            add('assemble', storage, assemble)
+            add('boundary', storage, setup.boundary_conditions)
+            done.add(storage)
+        else:
+            assemble()
+            setup.boundary_conditions()
+        add('solve', name, lambda: setup.solve(method, **options))
+    if setup is not None:
+        rng = np.random.RandomState(0)
+        xs = rng.uniform(geom.x_min, geom.x_max, PROBE_POINTS)
+        ys = rng.uniform(geom.y_min, geom.y_max, PROBE_POINTS)
+        add('probe_u', '', lambda: [setup.probe_u(x, y) for x, y in zip(xs, ys)])
+        gx, gy = np.meshgrid(np.linspace(geom.x_min, geom.x_max, PROBE_GRID),
+                             np.linspace(geom.y_min, geom.y_max, PROBE_GRID))
+        add('probe_many', '', lambda: setup.probe_many(gx, gy))
+    return mesh, rows
+
+def run_step(geom, is_axisym, step, solver_indices, repeat, memory):
+    '''
+    The best times of repeat runs and the peaks of one tracked run,
+    one dict per stage
+    '''
+    best = {}
+    for _ in range(repeat):
+        mesh, rows = run_once(geom, is_axisym, step, solver_indices, False)
+        for stage, variant, record in rows:
+            key = (stage, variant)
+            if key not in best:
+                best[key] = {'stage': stage, 'variant': variant, 'wall': record['wall'],
+                             'cpu': record['cpu'], 'peak_bytes': None,
+                             'counters': record['counters']}
+            else:
+                best[key]['wall'] = min(best[key]['wall'], record['wall'])
+                best[key]['cpu'] = min(best[key]['cpu'], record['cpu'])
+    if memory:
+        for stage, variant, record in run_once(geom, is_axisym, step, solver_indices, True)[1]:
+            best[(stage, variant)]['peak_bytes'] = record['peak_bytes']
+    for row in best.values():
+        row.update(step=step, nodes=len(mesh.coords), elements=len(mesh.elems))
+    return list(best.values())
+
+def fit_exponents(results):
+    '''
+    Slope of log(wall) against log(nodes) per case, stage and variant
+    '''
+    groups = {}
+    for r in results:
+        if r['wall'] >= MIN_FIT_TIME:
+            groups.setdefault((r['case'], r['stage'], r['variant']), []).append(r)
+    fits = []
+    for (case, stage, variant), rows in sorted(groups.items()):
+        nodes = np.log([r['nodes'] for r in rows])
+        if len(rows) < 2 or np.ptp(nodes) == 0:
+            continue
+        slope = np.polyfit(nodes, np.log([r['wall'] for r in rows]), 1)[0]
+        fits.append({'case': case, 'stage': stage, 'variant': variant,
+                     'exponent': float(slope), 'points': len(rows)})
+    return fits
+
+def revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       universal_newlines=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(old, new):
+    '''
+    Prints new/old wall time per matching row and the exponent changes
+    '''
+    def key(r):
+        return (r['case'], r['stage'], r['variant'], r.get('step'))
+    old_rows = {key(r): r for r in old['results']}
+    print("\nCompared with %s (%s)" % (old.get('revision'), old.get('date')))
+    print("%-10s %-10s %-32s %6s %9s %9s %7s" %
+          ("case", "stage", "variant", "step", "old s", "new s", "ratio"))
+    for r in new['results']:
+        o = old_rows.get(key(r))
+        if o is None:
+            continue
+        print("%-10s %-10s %-32s %6g %9.4f %9.4f %7.2f" %
+              (r['case'], r['stage'], r['variant'], r['step'], o['wall'], r['wall'],
+               r['wall']/o['wall'] if o['wall'] > 0 else float('inf')))
+    old_fits = {key(f): f for f in old['fits']}
+    for f in new['fits']:
+        o = old_fits.get(key(f))
+        if o is not None:
+            print("exponent %-10s %-10s %-32s %5.2f -> %5.2f" %
+                  (f['case'], f['stage'], f['variant'], o['exponent'], f['exponent']))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--steps', type=float, nargs='+', default=[4, 2, 1])
+    parser.add_argument('--cases', nargs='+', choices=sorted(cases), default=sorted(cases))
+    # without the pure python elimination (index 1), seconds already at 700 nodes
+    parser.add_argument('--solvers', type=int, nargs='+',
+                        default=[i for i in range(len(Controller.solvers)) if i != 1],
+                        help="indices into Controller.solvers")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--no-memory', action='store_true', help="skip the memory run")
+    parser.add_argument('-o', '--output', default='scaling.json')
+    parser.add_argument('--compare', help="results of an earlier run")
+    args = parser.parse_args()
+
+    util.verbose = False
+    results = []
+    print("%-10s %-10s %-32s %6s %9s %9s %9s %10s" %
+          ("case", "stage", "variant", "step", "nodes", "wall s", "cpu s", "peak MB"))
+    for case in args.cases:
+        geom, is_axisym = cases[case]()
+        for step in sorted(args.steps, reverse=True):
+            for row in run_step(geom, is_axisym, step, args.solvers,
+                                args.repeat, not args.no_memory):
+                row['case'] = case
+                results.append(row)
+                peak = row['peak_bytes']
+                print("%-10s %-10s %-32s %6g %9d %9.4f %9.4f %10s" %
+                      (case, row['stage'], row['variant'], step, row['nodes'], row['wall'],
+                       row['cpu'], '%.1f' % (peak/2**20) if peak is not None else '-'))
+    fits = fit_exponents(results)
+    print("\n%-10s %-10s %-32s %8s" % ("case", "stage", "variant", "exponent"))
+    for f in fits:
+        print("%-10s %-10s %-32s %8.2f" % (f['case'], f['stage'], f['variant'], f['exponent']))
+
+    out = {'format': FORMAT, 'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+           'revision': revision(), 'python': sys.version.split()[0],
+           'numpy': np.__version__, 'scipy': scipy.__version__,
+           'platform': platform.platform(), 'machine': platform.machine(),
+           'args': vars(args), 'results': results, 'fits': fits}
+    with open(args.output, 'w') as f:
+        json.dump(out, f, indent=1)
+    print("\nResults written to", args.output)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), out)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+'''
+Compares the solver options on growing meshes, without plotting
+
+Run from the repository root:
+python -m bench.solvers [--steps 4 2 1] [--axisym]
+'''
+import argparse
+import contextlib
+import io
+import time
+
+from fem.controller import Controller
+from fem.geometry import Geometry
+from fem.mesh import Mesh
+from fem.setup import Setup
+
+# dense storage and the pure python elimination are skipped above these sizes
+MAX_DENSE = 5000
+MAX_GAUSSIAN = 800
+
+def geometry():
+    geom = Geometry(0, 200, -100, 100)
+    geom.add_circular(40, 0, 10, 1)
+    geom.add_rectangular(100, 10, 140, 30, -1)
+    geom.add_circular(150, -60, 15, 2)
+    return geom
+
+def run(mesh, is_axisym, storage, method, options):
+    with contextlib.redirect_stdout(io.StringIO()):
+        t = time.time()
+        setup = Setup(mesh)
+        setup.init_system_mat(is_axisym, storage != 'dense', storage == 'matrix-free')
+        setup.boundary_conditions()
+        t_setup = time.time()-t
+        t = time.time()
+        setup.solve(method, **options)
+        t_solve = time.time()-t
+    iterations = len(setup.residuals)-1 if hasattr(setup, 'residuals') else ''
+    return setup.u, t_setup, t_solve, iterations
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--steps', type=float, nargs='+', default=[4, 2, 1])
+    parser.add_argument('--axisym', action='store_true')
+    args = parser.parse_args()
+
+    geom = geometry()
+    print("%-32s %6s %9s %9s %9s %6s %10s" %
+          ("solver", "step", "nodes", "setup s", "solve s", "iter", "max diff"))
+    for step in args.steps:
+        with contextlib.redirect_stdout(io.StringIO()):
+            mesh = Mesh(geom, step, step)
+            mesh.generate_mesh()
+        num_nodes = len(mesh.coords)
+        ref = None
+        for name, storage, method, options in Controller.solvers:
+            if storage == 'dense' and num_nodes > MAX_DENSE:
+                continue
+            if method == 1 and num_nodes > MAX_GAUSSIAN:
+                continue
+            u, t_setup, t_solve, iterations = run(mesh, args.axisym, storage, method, options)
+            if ref is None:
+                ref = u
+            print("%-32s %6g %9d %9.3f %9.3f %6s %10.2e" %
+                  (name, step, num_nodes, t_setup, t_solve, iterations, abs(u-ref).max()))
+
+if __name__ == '__main__':
+    main()
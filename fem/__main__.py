@@ -0,0 +1,90 @@
+'''
+Command line entry point, runs scenarios without the GUI or plotting
+
+python -m fem scenario.json [-o out.npz] [--workers N]
+
+The JSON file holds one scenario or a list of them, in the format of
+fem.batch. The output is written as .npz (arrays coords, elems, u,
+probes and a JSON string meta with name, timings and error; with
+several scenarios the keys get the suffix _<index>) or, for a .json
+output file, as JSON.
+'''
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+
+from fem.batch import run_scenario, run_batch
+
+ARRAYS = ('coords', 'elems', 'u', 'probes')
+
+def meta(result):
+    return {'name': result['name'], 'timings': result['timings'], 'error': result['error']}
+
+def write_npz(path, results, single):
+    arrays = {}
+    for index, result in enumerate(results):
+        suffix = '' if single else '_%d' % index
+        for key in ARRAYS:
+            if key in result:
+                arrays[key+suffix] = result[key]
+        arrays['meta'+suffix] = np.array(json.dumps(meta(result)))
+    np.savez(path, **arrays)
+
+def write_json(path, results, single):
+    out = []
+    for result in results:
+        d = meta(result)
+        for key in ARRAYS:
+            if key in result:
+                d[key] = np.asarray(result[key]).tolist()
+        out.append(d)
+    with open(path, 'w') as f:
+        json.dump(out[0] if single else out, f)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m fem', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('scenario', help="JSON scenario file, - for stdin")
+    parser.add_argument('-o', '--output', help="output .npz or .json file "
+                        "(default: the scenario file name with .npz)")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="worker processes for a list of scenarios")
+    args = parser.parse_args(argv)
+
+    if args.scenario == '-':
+        scenarios = json.load(sys.stdin)
+        output = args.output or 'result.npz'
+    else:
+        with open(args.scenario) as f:
+            scenarios = json.load(f)
+        output = args.output or os.path.splitext(args.scenario)[0]+'.npz'
+    single = isinstance(scenarios, dict)
+    if single:
+        scenarios = [scenarios]
+
+    if args.workers > 1 and len(scenarios) > 1:
+        results = run_batch(scenarios, args.workers)
+    else:
+        results = [run_scenario(s) for s in scenarios]
+
+    failed = 0
+    for index, result in enumerate(results):
+        name = result['name'] if result['name'] is not None else index
+        if result['error']:
+            failed += 1
+            print("%s: failed\n%s" % (name, result['error']), file=sys.stderr)
+        else:
+            print("%s: %d nodes, %.2f s" % (name, len(result['u']), result['timings']['total']))
+
+    if output.endswith('.json'):
+        write_json(output, results, single)
+    else:
+        write_npz(output, results, single)
+    print("Results written to", output)
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
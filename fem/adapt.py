@@ -0,0 +1,158 @@
+'''
+Adaptive mesh refinement: solve, estimate the error per element from the
+jumps of the normal field across the edges, refine the marked elements
+and solve again
+'''
+import numpy as np
+import fem.util as util
+from fem.mesh import TriMesh
+from fem.setup import Setup
+
+# local edges of an element, edge k goes from vertex k to vertex k+1
+LOCAL_EDGES = np.array([[0, 1], [1, 2], [2, 0]])
+
+def edge_table(elems):
+    '''
+    Unique edges of the mesh
+    Returns the node pairs (num_edges, 2) and the edge numbers
+    of the elements (m, 3)
+    '''
+    pairs = elems[:, LOCAL_EDGES].reshape(-1, 2).astype(np.int64)
+    lo = pairs.min(axis=1)
+    hi = pairs.max(axis=1)
+    key, inverse = np.unique(lo*(int(elems.max())+1)+hi, return_inverse=True)
+    n = int(elems.max())+1
+    edges = np.column_stack((key//n, key%n))
+    return edges, inverse.reshape(-1, 3)
+
+def estimate(setup, is_axisym=False):
+    '''
+    Error indicator of every element (m,):
+    eta_T^2 = sum over the edges of T of h_e^2*J_e^2/(elements on e),
+    J_e is the jump of the normal component of the field across the edge
+    (the normal field itself on the outer boundary, where it should be 0).
+    Edges with both nodes on electrodes are skipped. With is_axisym the
+    terms are weighted by 2*pi*r as the stiffness matrix
+    '''
+    mesh = setup.mesh
+    elems = mesh.elems
+    edges, elem_edges = edge_table(elems)
+    grad = setup.lin_coefs()[:, 1:]
+    p = mesh.coords[elems]
+    d = p[:, [1, 2, 0]]-p # edge vectors (m, 3, 2)
+    area2 = d[:, 0, 0]*d[:, 1, 1]-d[:, 0, 1]*d[:, 1, 0]
+    # outward normals times the edge lengths
+    normal = np.stack((d[..., 1], -d[..., 0]), axis=-1)*np.sign(area2)[:, None, None]
+    flux = (normal*grad[:, None, :]).sum(axis=2) # (m, 3), g.n*h
+    num_edges = len(edges)
+    jump = np.bincount(elem_edges.ravel(), flux.ravel(), minlength=num_edges)
+    count = np.bincount(elem_edges.ravel(), minlength=num_edges)
+    jump[mesh.on_el[edges].all(axis=1)] = 0
+    # h_e^2*J_e^2 = (g.n*h)^2 as the jump is already scaled by h
+    term = jump**2/count
+    if is_axisym:
+        term *= 2*np.pi*np.abs(mesh.coords[edges, 0].mean(axis=1))
+    return np.sqrt(term[elem_edges].sum(axis=1))
+
+def mark(eta, theta=0.5):
+    '''
+    Bulk marking: the smallest set of elements with the largest indicators
+    whose sum of eta^2 is at least theta times the total
+    '''
+    order = np.argsort(-eta**2)
+    cumulative = np.cumsum(eta[order]**2)
+    num = np.searchsorted(cumulative, theta*cumulative[-1])+1
+    marked = np.zeros(len(eta), dtype=bool)
+    marked[order[:num]] = True
+    return marked
+
+def refine(mesh, marked):
+    '''
+    Red-green-blue refinement. All edges of the marked elements are
+    bisected, and the longest edge of every element with a bisected edge
+    is bisected too, so no hanging nodes are left and the angles stay
+    bounded. Depending on its bisected edges an element is split in
+    2 (green), 3 (blue) or 4 (red) triangles.
+    The new nodes are assigned to electrodes by the geometry.
+    Returns a new TriMesh
+    '''
+    elems = mesh.elems.astype(np.int64)
+    coords = mesh.coords
+    edges, elem_edges = edge_table(elems)
+    length = np.hypot(*(coords[edges[:, 1]]-coords[edges[:, 0]]).T)
+    longest = np.argmax(length[elem_edges], axis=1)
+    rows = np.arange(len(elems))
+    longest_edge = elem_edges[rows, longest]
+
+    bisect = np.zeros(len(edges), dtype=bool)
+    bisect[elem_edges[marked].ravel()] = True
+    while True:
+        closure = bisect[elem_edges].any(axis=1) & ~bisect[longest_edge]
+        if not closure.any():
+            break
+        bisect[longest_edge[closure]] = True
+
+    num_nodes = len(coords)
+    mid = np.full(len(edges), -1, dtype=np.int64)
+    mid[bisect] = num_nodes+np.arange(bisect.sum())
+    mid_coords = coords[edges[bisect]].mean(axis=1)
+    new_index = mesh.geometry.electrode_index(mid_coords[:, 0], mid_coords[:, 1])
+
+    # local numbering A, B, C with the longest edge AB
+    a = elems[rows, longest]
+    b = elems[rows, (longest+1)%3]
+    c = elems[rows, (longest+2)%3]
+    e_ab = longest_edge
+    e_bc = elem_edges[rows, (longest+1)%3]
+    e_ca = elem_edges[rows, (longest+2)%3]
+    m = mid[e_ab]
+    n = mid[e_bc]
+    p = mid[e_ca]
+    has_m = bisect[e_ab]
+    has_n = bisect[e_bc]
+    has_p = bisect[e_ca]
+
+    keep = ~has_m
+    green = has_m & ~has_n & ~has_p
+    blue_n = has_m & has_n & ~has_p
+    blue_p = has_m & ~has_n & has_p
+    red = has_m & has_n & has_p
+    def tri(mask, *nodes):
+        return np.column_stack([v[mask] for v in nodes])
+    new_elems = np.concatenate((
+        tri(keep, a, b, c),
+        tri(green, a, m, c), tri(green, m, b, c),
+        tri(blue_n, a, m, c), tri(blue_n, m, b, n), tri(blue_n, m, n, c),
+        tri(blue_p, m, b, c), tri(blue_p, a, m, p), tri(blue_p, m, c, p),
+        tri(red, a, m, p), tri(red, m, b, n), tri(red, p, n, c), tri(red, m, n, p)))
+    return TriMesh(mesh.geometry, np.concatenate((coords, mid_coords)), new_elems,
+                   np.concatenate((mesh.el_index, new_index)))
+
+def adapt(mesh, is_axisym, tol=0.01, theta=0.5, max_nodes=200000, max_steps=30,
+          method=3, **options):
+    '''
+    Solve - estimate - mark - refine loop, starting from mesh (a Mesh or
+    a TriMesh). Stops when the estimated relative error in the energy norm
+    (sqrt(sum eta^2)/sqrt(u^T*K*u)) is below tol, or at the node or step
+    limits. method and options are passed to Setup.solve
+    Returns the last Setup and the history [(nodes, estimate), ...]
+    '''
+    if not isinstance(mesh, TriMesh):
+        mesh = TriMesh.from_mesh(mesh)
+    history = []
+    for step in range(max_steps+1):
+        util.tic('adapt')
+        setup = Setup(mesh)
+        setup.init_system_mat(is_axisym, sparse=True)
+        setup.boundary_conditions()
+        setup.solve(method, **options)
+        eta = estimate(setup, is_axisym)
+        energy = setup.u.dot(setup.sys.dot(setup.u))
+        error = np.sqrt((eta**2).sum()/energy) if energy > 0 else 0.0
+        history.append((len(mesh.coords), error))
+        util.toc("Adaptive step %d: %d nodes, estimated error %.2e, %%.2f s" %
+                 (step, len(mesh.coords), error), nodes=len(mesh.coords), elements=len(mesh.elems))
+        if error <= tol or len(mesh.coords) >= max_nodes or step == max_steps:
+            break
+        mesh = refine(mesh, mark(eta, theta))
+    return setup, history
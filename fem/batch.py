@@ -0,0 +1,161 @@
+'''
+Runs many scenarios in parallel on a process pool
+
+A scenario is a plain dict:
+{'name': 'case 1',                          # optional
+ 'limits': [x_min, x_max, y_min, y_max],
+ 'electrodes': [{'type': 'circular', 'x': 0, 'y': 0, 'r': 10, 'u': 1},
+                {'type': 'rectangular', 'x1': 20, 'y1': 0, 'x2': 30, 'y2': 10, 'u': -1}],
+ 'step': [x_step, y_step],                  # or one number for both
+ 'grading': [h_min, h_max, growth],         # optional, graded grid instead of step
+ 'axisym': False,
+ 'order': 1,                                # 2 for quadratic elements
+ 'solver': 3,                               # index or name in Controller.solvers
+ 'probes': [[x, y], ...]}                   # optional
+'''
+import contextlib
+import io
+import os
+import time
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+
+from fem.controller import Controller
+from fem.geometry import Geometry
+from fem.mesh import Mesh
+from fem.setup import Setup
+
+def solver_entry(solver):
+    '''
+    The Controller.solvers entry of an index or a name
+    '''
+    if isinstance(solver, str):
+        for entry in Controller.solvers:
+            if entry[0] == solver:
+                return entry
+        raise ValueError("Unknown solver: %s" % solver)
+    return Controller.solvers[solver]
+
+def run_scenario(scenario):
+    '''
+    Runs one scenario and returns a dict of plain values and arrays:
+    name, coords, elems, u, probes, timings (s), log (the printed output)
+    and error (None or the traceback). Exceptions are caught, so a bad
+    scenario only fails itself
+    '''
+    result = {'name': scenario.get('name'), 'timings': {}, 'error': None}
+    timings = result['timings']
+    log = io.StringIO()
+    start = time.time()
+    try:
+        with contextlib.redirect_stdout(log):
+            t = time.time()
+            geom = Geometry.from_dict(scenario)
+            if scenario.get('grading') is not None:
+                mesh = Mesh.graded(geom, *scenario['grading'])
+            else:
+                step = scenario.get('step', 1)
+                x_step, y_step = (step, step) if np.ndim(step) == 0 else step
+                mesh = Mesh(geom, x_step, y_step)
+            mesh.generate_mesh()
+            timings['mesh'] = time.time()-t
+
+            t = time.time()
+            name, storage, method, options = solver_entry(scenario.get('solver', 3))
+            if scenario.get('order', 1) == 2:
+                from fem.quadratic import QuadraticMesh, QuadraticSetup
+                setup = QuadraticSetup(QuadraticMesh(mesh))
+            else:
+                setup = Setup(mesh)
+            setup.init_system_mat(bool(scenario.get('axisym', False)),
+                                  storage != 'dense', storage == 'matrix-free')
+            setup.boundary_conditions()
+            timings['assemble'] = time.time()-t
+
+            t = time.time()
+            setup.solve(method, **options)
+            timings['solve'] = time.time()-t
+
+            result['coords'] = setup.mesh.coords
+            result['elems'] = setup.mesh.elems
+            result['u'] = setup.u
+            probes = scenario.get('probes')
+            if probes is not None:
+                probes = np.asarray(probes, dtype=float).reshape(-1, 2)
+                t = time.time()
+                result['probes'] = setup.probe_many(probes[:, 0], probes[:, 1])
+                timings['probe'] = time.time()-t
+    except Exception:
+        result['error'] = traceback.format_exc()
+    timings['total'] = time.time()-start
+    result['log'] = log.getvalue()
+    return result
+
+def failed(scenario, error):
+    return {'name': scenario.get('name'), 'timings': {}, 'log': '', 'error': error}
+
+def run_isolated(scenario):
+    '''
+    run_scenario in a worker process of its own, a crash of the
+    process is reported as the error of the scenario
+    '''
+    with ProcessPoolExecutor(max_workers=1) as pool:
+        try:
+            return pool.submit(run_scenario, scenario).result()
+        except Exception:
+            return failed(scenario, traceback.format_exc())
+
+def iter_batch(scenarios, workers=None):
+    '''
+    Runs the scenarios on a pool of worker processes (workers=None uses
+    all CPUs) and yields (index, result) in the order they complete.
+    At most one scenario per worker is submitted at a time, so when a
+    worker dies (killed or crashed) the scenarios that were running are
+    known. If it was only one, the crash is its error, otherwise they are
+    run again one at a time in processes of their own to find the one
+    that crashes. The rest of the batch continues on a new pool
+    '''
+    workers = workers or os.cpu_count() or 1
+    todo = list(range(len(scenarios)))[::-1]
+    while todo:
+        suspects = []
+        crash = None
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            running = {}
+            while (todo or running) and not suspects:
+                while todo and len(running) < workers:
+                    index = todo.pop()
+                    running[pool.submit(run_scenario, scenarios[index])] = index
+                for future in wait(running, return_when=FIRST_COMPLETED)[0]:
+                    index = running.pop(future)
+                    try:
+                        result = future.result()
+                    except BrokenProcessPool:
+                        suspects.append(index)
+                        crash = traceback.format_exc()
+                        continue
+                    except Exception:
+                        result = failed(scenarios[index], traceback.format_exc())
+                    yield index, result
+            # the pool is broken, the scenarios still running failed with it
+            suspects += running.values()
+        if len(suspects) == 1:
+            yield suspects[0], failed(scenarios[suspects[0]], crash)
+        else:
+            for index in sorted(suspects):
+                yield index, run_isolated(scenarios[index])
+
+def run_batch(scenarios, workers=None, callback=None):
+    '''
+    Runs all scenarios and returns the results in the order of scenarios.
+    callback(index, result) is called as each one completes
+    '''
+    results = [None]*len(scenarios)
+    for index, result in iter_batch(scenarios, workers):
+        results[index] = result
+        if callback is not None:
+            callback(index, result)
+    return results
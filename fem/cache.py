@@ -0,0 +1,212 @@
+'''
+Content-addressed on-disk cache of meshes, system matrices and
+factorizations
+
+An entry is a directory in the fem.storage format, named by the SHA-256 of
+what it was computed from: the geometry (limits and electrode shapes, not
+their potentials, which are applied after loading), the steps, the planar or
+axisymmetric mode and the solver. Entries are written to a temporary
+directory and renamed into place, so processes sharing the cache never see
+a partial entry; if two of them compute the same entry, the first rename
+wins. Loaded entries are memory-mapped.
+The size is bounded by max_bytes, the least recently used entries (by the
+time stamp of meta.json, touched on every hit) are evicted first.
+'''
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+import fem.storage as storage
+import fem.util as util
+from fem.mesh import Mesh
+
+try:
+    import fcntl
+except ImportError: # not on Windows, eviction is then unlocked
+    fcntl = None
+
+def shape_dict(geometry):
+    '''
+    geometry.to_dict without the electrode potentials
+    '''
+    d = geometry.to_dict()
+    d['electrodes'] = [{k: v for k, v in el.items() if k != 'u'} for el in d['electrodes']]
+    return d
+
+def make_key(*parts):
+    text = json.dumps([storage.VERSION]+list(parts), sort_keys=True)
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+class DiskCache(object):
+    '''
+    root: cache directory (default ~/.cache/py-simple-fem)
+    max_bytes: size limit of all entries
+    Hits and misses are counted per kind of entry in self.hits, self.misses
+    '''
+    def __init__(self, root=None, max_bytes=2**30):
+        if root is None:
+            root = os.path.join(os.path.expanduser('~'), '.cache', 'py-simple-fem')
+        self.root = root
+        self.max_bytes = max_bytes
+        self.hits = {}
+        self.misses = {}
+        if not os.path.isdir(root):
+            os.makedirs(root, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.root, key)
+
+    def get(self, key, kind):
+        '''
+        The header and arrays of the entry, None on a miss
+        '''
+        try:
+            meta, arrays = storage.load_arrays(self.path(key), [kind])
+            os.utime(os.path.join(self.path(key), 'meta.json'))
+        except (ValueError, OSError):
+            # missing, incomplete or evicted meanwhile by another process
+            self.misses[kind] = self.misses.get(kind, 0)+1
+            return None
+        self.hits[kind] = self.hits.get(kind, 0)+1
+        return meta, arrays
+
+    def put(self, key, kind, meta, arrays):
+        tmp = tempfile.mkdtemp(prefix='.tmp-', dir=self.root)
+        storage.save_arrays(tmp, kind, meta, arrays)
+        try:
+            os.rename(tmp, self.path(key))
+        except OSError:
+            # another process stored it first
+            shutil.rmtree(tmp, ignore_errors=True)
+        self.evict()
+
+    def entries(self):
+        '''
+        (last use, size in bytes, key) of the complete entries
+        '''
+        out = []
+        for key in os.listdir(self.root):
+            path = self.path(key)
+            if key.startswith('.'):
+                continue
+            try:
+                used = os.stat(os.path.join(path, 'meta.json')).st_mtime
+                size = sum(os.stat(os.path.join(path, f)).st_size for f in os.listdir(path))
+            except OSError:
+                continue
+            out.append((used, size, key))
+        return out
+
+    def evict(self):
+        '''
+        Removes the least recently used entries until the size is within
+        max_bytes. Entries are renamed away first, so readers that have them
+        memory-mapped keep their data
+        '''
+        lock = open(os.path.join(self.root, '.lock'), 'w')
+        try:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            entries = sorted(self.entries())
+            total = sum(e[1] for e in entries)
+            for used, size, key in entries:
+                if total <= self.max_bytes:
+                    break
+                trash = tempfile.mkdtemp(prefix='.evict-', dir=self.root)
+                try:
+                    os.rename(self.path(key), os.path.join(trash, key))
+                except OSError:
+                    pass
+                shutil.rmtree(trash, ignore_errors=True)
+                total -= size
+        finally:
+            lock.close()
+
+    def stats(self):
+        '''
+        Hits and misses per kind, number of entries and their size in bytes
+        '''
+        entries = self.entries()
+        return {'hits': dict(self.hits), 'misses': dict(self.misses),
+                'entries': len(entries), 'bytes': sum(e[1] for e in entries)}
+
+    def clear(self):
+        for used, size, key in self.entries():
+            shutil.rmtree(self.path(key), ignore_errors=True)
+
+    def mesh(self, geometry, x_step, y_step):
+        '''
+        Mesh.generate_mesh through the cache. The electrode potentials
+        of the current geometry are applied to the loaded mesh.
+        The key is kept in mesh.cache_key for the system and factor entries
+        '''
+        key = make_key('mesh', shape_dict(geometry), x_step, y_step)
+        entry = self.get(key, 'mesh')
+        if entry is None:
+            mesh = Mesh(geometry, x_step, y_step)
+            mesh.generate_mesh()
+            meta, arrays = storage.mesh_arrays(mesh)
+            self.put(key, 'mesh', meta, arrays)
+        else:
+            mesh = storage.make_mesh(*entry)
+            mesh.geometry = geometry
+            mesh.u_el = np.append(geometry.potentials(), 0.0)[mesh.el_index]
+            util.log("Mesh loaded from the cache")
+        mesh.cache_key = key
+        return mesh
+
+    def init_system_mat(self, setup, is_axisym):
+        '''
+        setup.init_system_mat(is_axisym, sparse=True) through the cache,
+        for a mesh from self.mesh
+        '''
+        key = make_key('system', setup.mesh.cache_key, bool(is_axisym))
+        entry = self.get(key, 'matrix')
+        if entry is None:
+            setup.init_system_mat(is_axisym, sparse=True)
+            meta, arrays = storage.matrix_arrays(setup.sys)
+            self.put(key, 'matrix', meta, arrays)
+        else:
+            setup.sys = storage.make_matrix(*entry)
+            util.log("System matrix loaded from the cache")
+        setup.cache_key = key
+
+    def solve(self, setup, method, **options):
+        '''
+        setup.solve through the cache, after init_system_mat and
+        boundary_conditions. The skyline Cholesky factor (method 2) and the
+        IC(0) preconditioner (method 4) are cached, other methods are
+        solved as usual
+        '''
+        import fem.pcg as pcg
+        import fem.skyline as skyline
+        if method == 2:
+            key = make_key('skyline', setup.cache_key, options.get('reorder', True))
+            entry = self.get(key, 'factor')
+            if entry is not None:
+                meta, arrays = entry
+                setup.factor = skyline.SkylineMatrix.from_arrays(
+                    arrays['first'], arrays['ptr'], arrays['values'], meta['nnz'])
+                setup.perm = arrays['perm']
+            setup.solve(method, **options)
+            if entry is None:
+                sky = setup.factor
+                self.put(key, 'factor', {'nnz': int(sky.nnz)},
+                         {'first': sky.first, 'ptr': sky.ptr, 'values': sky.values,
+                          'perm': setup.perm})
+        elif method == 4 and options.get('precond') == 'ic0':
+            key = make_key('ic0', setup.cache_key)
+            entry = self.get(key, 'factor')
+            if entry is not None:
+                meta, arrays = entry
+                setup.factor = pcg.IncompleteCholesky(None, storage.make_matrix(meta, arrays))
+            setup.solve(method, **options)
+            if entry is None:
+                meta, arrays = storage.matrix_arrays(setup.factor.low)
+                self.put(key, 'factor', meta, arrays)
+        else:
+            setup.solve(method, **options)
@@ -3,58 +3,188 @@ Created on 23 Jan 2015
 
 @author: Kristjan
 '''
+import numpy as np
 
 from fem.geometry import Geometry
 from fem.mesh import Mesh
 from fem.setup import Setup
-
-import matplotlib.pyplot as plt
+from fem.sweep import Sweep
+import fem.postproc as postproc
 
 class Controller(object):
     
-    def __init__(self):
+    # solver name, system matrix storage, Setup.solve method and its options
+    solvers = [('Numpy/Numpy matrix', 'dense', 0, {}),
+               ('Gaussian el./Numpy matrix', 'dense', 1, {}),
+               ('Gaussian el./skyline storage', 'sparse', 2, {}),
+               ('Sparse LU/CSR matrix', 'sparse', 3, {}),
+               ('PCG IC(0)/CSR matrix', 'sparse', 4, {'precond': 'ic0'}),
+               ('PCG Jacobi/matrix-free', 'matrix-free', 4, {'precond': 'jacobi'}),
+               ('Multigrid/CSR matrix', 'sparse', 5, {}),
+               ('PCG multigrid/CSR matrix', 'sparse', 4, {'precond': 'mg'})]
+    
+    def __init__(self, cache=None):
+        '''
+        cache: a fem.cache.DiskCache for the meshes, system matrices and
+        factorizations, or None
+        '''
         self.geometry = Geometry()
+        self.cache = cache
     
     def draw_geom(self):
-        self.geometry.draw()
-        plt.show()
+        from fem import render
+        render.draw_geometry(self.geometry)
+        render.show()
     
     def reset_geom(self, xmin, xmax, ymin, ymax):
         self.geometry = Geometry(xmin, xmax, ymin, ymax)
     
     def generate_mesh(self, xstep, ystep):
-        self.mesh = Mesh(self.geometry, xstep, ystep)
-        self.mesh.generate_mesh()
+        '''
+        The mesh is made for a copy of the geometry and replaces the current
+        one when it's done, so the geometry can be edited and the last
+        solution probed while it runs on another thread
+        '''
+        geometry = self.geometry.copy()
+        if self.cache is not None:
+            self.mesh = self.cache.mesh(geometry, xstep, ystep)
+            return
+        mesh = Mesh(geometry, xstep, ystep)
+        mesh.generate_mesh()
+        self.mesh = mesh
+    
+    def adapt_mesh(self, geom_type, tol=0.01, max_nodes=200000):
+        '''
+        Adaptive refinement starting from the current mesh, the refined
+        mesh and its solution replace the current ones
+        '''
+        from fem.adapt import adapt
+        self.setup, history = adapt(self.mesh, geom_type, tol, max_nodes=max_nodes)
+        self.mesh = self.setup.mesh
+        return history
     
     def draw_mesh(self, nodes_only):
-        self.mesh.draw(nodes_only)
-        axes = plt.gca()
-        self.geometry.draw()
-        axes.set_xlim([self.geometry.x_min, self.geometry.x_max])
-        axes.set_ylim([self.geometry.y_min, self.geometry.y_max])
-        plt.show()
-    
-    def solve(self, geom_type, method_index):
-        self.setup = Setup(self.mesh)
-        self.setup.init_system_mat(geom_type)
-        self.setup.boundary_conditions()
-        self.setup.solve(method_index)
+        from fem import render
+        render.draw_mesh(self.mesh, nodes_only)
+        render.draw_geometry(self.geometry)
+        render.show()
+    
+    def solver_names(self):
+        return [s[0] for s in self.solvers]
+    
+    def solve(self, geom_type, method_index, order=1):
+        '''
+        order 2 solves with quadratic elements on the nodes of the mesh
+        and the middles of its edges. The new solution replaces the
+        current one when it's done
+        '''
+        name, storage, method, options = self.solvers[method_index]
+        mesh = self.mesh
+        if order == 2:
+            from fem.quadratic import QuadraticMesh, QuadraticSetup
+            setup = QuadraticSetup(QuadraticMesh(mesh))
+        else:
+            setup = Setup(mesh)
+        cached = (self.cache is not None and storage == 'sparse' and order == 1 and
+                  hasattr(mesh, 'cache_key'))
+        if cached:
+            self.cache.init_system_mat(setup, geom_type)
+        else:
+            setup.init_system_mat(geom_type, storage != 'dense', storage == 'matrix-free')
+        setup.boundary_conditions()
+        if cached:
+            self.cache.solve(setup, method, **options)
+        else:
+            setup.solve(method, **options)
+        self.setup = setup
+        self.solved = (setup, mesh.geometry.to_dict(), geom_type)
+    
+    def resolve(self, geom_type, method_index):
+        '''
+        Solves again after electrodes were added, moved, removed or their
+        potentials changed. The last solution of solve or resolve is updated
+        with fem.incremental when it's on the current mesh, otherwise the mesh
+        is generated again with the same steps and solved
+        '''
+        from fem import incremental
+        name, storage, method, options = self.solvers[method_index]
+        solved = getattr(self, 'solved', None)
+        geometry = self.geometry.copy()
+        if (solved is not None and solved[0] is getattr(self, 'setup', None) and
+                solved[0].mesh is self.mesh and solved[2] == geom_type and
+                incremental.can_update(solved[0], solved[1], geometry)):
+            setup = incremental.update(solved[0], solved[1], geometry, geom_type,
+                                       method, **options)
+            self.mesh = setup.mesh
+            self.setup = setup
+            self.solved = (setup, geometry.to_dict(), geom_type)
+            return
+        if getattr(self.mesh, 'x_step', None) is None or self.mesh.y_step is None:
+            raise ValueError("Only a uniform mesh can be generated again, generate the mesh first")
+        self.generate_mesh(self.mesh.x_step, self.mesh.y_step)
+        self.solve(geom_type, method_index)
+    
+    def sweep(self, geom_type, voltages):
+        '''
+        Solutions for electrode voltages (num_el,) or (batch, num_el),
+        the factorization and basis are reused while the mesh is the same.
+        A single voltage set also becomes the solution for drawing and probing
+        '''
+        sweep = self.get_sweep(geom_type)
+        if np.ndim(voltages) == 1:
+            self.setup = sweep.apply(voltages)
+            return self.setup.u
+        return sweep.solve(voltages)
+    
+    def get_sweep(self, geom_type):
+        sweep = getattr(self, 'sweeper', None)
+        if sweep is None or sweep.mesh is not self.mesh or sweep.is_axisym != geom_type:
+            self.sweeper = Sweep(self.mesh, geom_type)
+        return self.sweeper
+    
+    def charges(self):
+        return postproc.charges(self.setup)
+    
+    def energy(self):
+        return postproc.energy(self.setup)
+    
+    def capacitance(self, geom_type):
+        return postproc.capacitance_matrix(self.get_sweep(geom_type))
     
     def draw_solution(self, with_nodes, with_geom):
+        from fem import render
         if with_geom:
-            self.geometry.draw()
+            render.draw_geometry(self.geometry)
         if with_nodes:
-            self.mesh.draw(1)
-        self.setup.draw()
-        axes = plt.gca()
-        axes.set_xlim([self.geometry.x_min, self.geometry.x_max])
-        axes.set_ylim([self.geometry.y_min, self.geometry.y_max])
-        plt.show()
+            render.draw_mesh(self.mesh, 1)
+        render.draw_solution(self.setup)
+        render.set_limits(self.geometry)
+        render.show()
+    
+    def save_solution(self, path):
+        from fem import storage
+        storage.save_solution(path, self.setup)
+    
+    def load_solution(self, path):
+        '''
+        Loads a saved solution (memory-mapped) with its mesh and geometry
+        '''
+        from fem import storage
+        self.setup = storage.load_solution(path)
+        self.mesh = self.setup.mesh
+        self.geometry = self.mesh.geometry
     
     def probe_value(self, x, y):
         return self.setup.probe_u(x, y)
     
+    def probe_values(self, xs, ys):
+        return self.setup.probe_many(xs, ys)
+    
+    def field_values(self, xs, ys):
+        return self.setup.field_at(xs, ys)
+    
     def start(self):
+        from fem import render
         
         self.geometry.add_circular(-20, 0, 10, 1)
         #geom.add_circular(50, 0, 10, 0)
@@ -66,11 +196,11 @@ class Controller(object):
         mesh = Mesh(self.geometry, 1.5, 1.5)
         mesh.generate_mesh()
         setup = Setup(mesh)
-        setup.init_system_mat()
+        setup.init_system_mat(False, sparse=True)
         setup.boundary_conditions()
-        setup.solve()
+        setup.solve(3)
         
-        self.geometry.draw()
+        render.draw_geometry(self.geometry)
         mesh.draw(1)
         setup.draw()
-        plt.show()
+        render.show()
@@ -3,8 +3,8 @@ Created on 11 Jan 2015
 
 @author: Kristjan
 '''
-import matplotlib.patches as pth
-import matplotlib.pyplot as plt
+import numpy as np
+import fem.util as util
 
 class CircularElectrode(object):
     
@@ -19,8 +19,21 @@ class CircularElectrode(object):
             return True
         return False
     
+    def mask(self, x, y):
+        '''
+        is_inside for arrays of points
+        '''
+        return (self.x-x)**2 + (self.y-y)**2 <= self.r**2
+    
+    def bounds(self):
+        return self.x-self.r, self.x+self.r, self.y-self.r, self.y+self.r
+    
+    def to_dict(self):
+        return {'type': 'circular', 'x': self.x, 'y': self.y, 'r': self.r, 'u': self.u}
+    
     def image(self):
-        return pth.Circle((self.x,self.y),self.r,color='0.75', zorder=1)
+        from fem import render
+        return render.electrode_image(self)
 
 class RectangularElectrode(object):
     '''
@@ -40,6 +53,18 @@ class RectangularElectrode(object):
             return True
         return False
     
+    def mask(self, x, y):
+        '''
+        is_inside for arrays of points
+        '''
+        x_inside = (x <= self.x1) & (x >= self.x2) | (x >= self.x1) & (x <= self.x2)
+        y_inside = (y <= self.y1) & (y >= self.y2) | (y >= self.y1) & (y <= self.y2)
+        return x_inside & y_inside
+    
+    def bounds(self):
+        return (min(self.x1, self.x2), max(self.x1, self.x2),
+                min(self.y1, self.y2), max(self.y1, self.y2))
+    
     def is_inside2(self, x, y):
         '''
         Check based on inner products
@@ -52,10 +77,13 @@ class RectangularElectrode(object):
             return True
         return False
     
+    def to_dict(self):
+        return {'type': 'rectangular', 'x1': self.x1, 'y1': self.y1,
+                'x2': self.x2, 'y2': self.y2, 'u': self.u}
+    
     def image(self):
-        w = self.x2-self.x1
-        h = self.y2-self.y1
-        return pth.Rectangle((self.x1, self.y1), w, h, angle=0.0, color='0.75', zorder=1)
+        from fem import render
+        return render.electrode_image(self)
 
 class Geometry(object):
     '''
@@ -75,17 +103,65 @@ class Geometry(object):
     def add_rectangular(self, x1, y1, x2, y2, u):
         self.electrodes.append(RectangularElectrode(x1, y1, x2, y2, u))
     
+    def to_dict(self):
+        '''
+        Plain description of the geometry (for JSON and for sending
+        to other processes):
+        {'limits': [x_min, x_max, y_min, y_max], 'electrodes': [...]}
+        '''
+        return {'limits': [self.x_min, self.x_max, self.y_min, self.y_max],
+                'electrodes': [el.to_dict() for el in self.electrodes]}
+    
+    @staticmethod
+    def from_dict(d):
+        geom = Geometry(*d.get('limits', (-100, 100, -100, 100)))
+        for el in d.get('electrodes', []):
+            if el['type'] == 'circular':
+                geom.add_circular(el['x'], el['y'], el['r'], el['u'])
+            elif el['type'] == 'rectangular':
+                geom.add_rectangular(el['x1'], el['y1'], el['x2'], el['y2'], el['u'])
+            else:
+                raise ValueError("Unknown electrode type: %s" % el['type'])
+        return geom
+    
+    def copy(self):
+        return Geometry.from_dict(self.to_dict())
+    
     def is_electrode(self, x, y):
+        util.count(is_electrode=1)
         for el in self.electrodes:
             if el.is_inside(x, y):
                 return [True, el.u]
         return [False, 0]
     
+    def electrode_index(self, x, y):
+        '''
+        Index in self.electrodes of the electrode at each point, -1 if none.
+        The first matching electrode wins, as in is_electrode
+        '''
+        x, y = np.broadcast_arrays(np.asarray(x, dtype=float), np.asarray(y, dtype=float))
+        util.count(electrode_points=x.size)
+        index = np.full(x.shape, -1, dtype=np.int32)
+        for k, el in enumerate(self.electrodes):
+            inside = el.mask(x, y)
+            inside &= index < 0
+            index[inside] = k
+        return index
+    
+    def potentials(self):
+        return np.array([el.u for el in self.electrodes], dtype=float)
+    
+    def electrode_mask(self, x, y):
+        '''
+        is_electrode for arrays of points
+        returns the boolean mask and the potential (0 outside electrodes)
+        '''
+        index = self.electrode_index(x, y)
+        # index -1 picks the 0 appended to the potentials
+        return index >= 0, np.append(self.potentials(), 0.0)[index]
+    
     def draw(self):
-        axes = plt.gca()
-        for el in self.electrodes:
-            axes.add_patch(el.image())
-        axes.set_xlim([self.x_min, self.x_max])
-        axes.set_ylim([self.y_min, self.y_max])
+        from fem import render
+        render.draw_geometry(self)
     
     
\ No newline at end of file
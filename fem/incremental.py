@@ -0,0 +1,340 @@
+'''
+Incremental update of a solution after the electrodes change
+
+The geometry the solution was computed for is compared with the current one
+(electrode_changes): electrodes of the same shape are matched in order, the
+others count as added, removed or moved. When only potentials changed, the
+mesh, the matrix and the factorization of the solver are kept and only the
+right hand side is patched, for the columns of the changed electrode nodes.
+Otherwise the grid is rasterized again only in a window around the old and
+new bounds of the changed electrodes (update_mesh), the matrix rows and
+columns of the nodes of the changed elements are assembled again while the
+rest of the matrix is renumbered (update_matrix), the coarse levels of the
+multigrid preconditioner are updated the same way (update_multigrid), and
+the new system is solved starting from the previous solution.
+The electrode tests, the element matrices, the prolongation rows and the
+Galerkin products scale with the change. The renumbering of the meshes and
+matrices and the boundary conditions are vectorized passes over the whole
+mesh, and every solver iteration is too, fewer of them are needed for
+smaller changes.
+'''
+import copy
+
+import numpy as np
+import scipy.sparse as sp
+import scipy.sparse.linalg as spla
+
+import fem.multigrid as multigrid
+import fem.util as util
+from fem.geometry import Geometry
+from fem.mesh import Element, ItemList, Mesh, Node, with_potentials
+from fem.setup import Setup, element_mats, element_mats_axisym
+
+def shape(el):
+    return {k: v for k, v in el.items() if k != 'u'}
+
+def electrode_changes(old, geometry):
+    '''
+    old: geometry.to_dict() of the geometry before the change
+    Returns the new index of every old electrode (-1 if it was removed or
+    moved) and the bounds of the changed electrodes, before and after
+    '''
+    old = old['electrodes']
+    new = geometry.to_dict()['electrodes']
+    remap = np.full(len(old), -1, dtype=np.int32)
+    boxes = []
+    start = 0
+    for k, el in enumerate(new):
+        # the next old electrode of the same shape, so the order is kept
+        # and the first matching electrode still wins at every point
+        match = next((m for m in range(start, len(old)) if shape(old[m]) == shape(el)), None)
+        if match is None:
+            boxes.append(geometry.electrodes[k].bounds())
+        else:
+            remap[match] = k
+            start = match+1
+    removed = Geometry.from_dict({'electrodes': [old[m] for m in np.flatnonzero(remap < 0)]})
+    boxes += [el.bounds() for el in removed.electrodes]
+    return remap, boxes
+
+def update_mesh(mesh, geometry, remap, boxes):
+    '''
+    A new Mesh of geometry from mesh, rasterized again in the window of the
+    grid covering the boxes. Returns it, the new number of every old node
+    (-1 if removed) and the window of cells (i0, i1, j0, j1) whose
+    elements can differ
+    '''
+    util.tic('mesh')
+    nx, ny = mesh.num_nodes_x, mesh.num_nodes_y
+    # the lines inside the boxes, one more on each side for rounding and
+    # one more for the points with a changed neighbour
+    i0 = max(np.searchsorted(mesh.x_lines, min(b[0] for b in boxes))-2, 0)
+    i1 = min(np.searchsorted(mesh.x_lines, max(b[1] for b in boxes), 'right')+2, nx)
+    j0 = max(np.searchsorted(mesh.y_lines, min(b[2] for b in boxes))-2, 0)
+    j1 = min(np.searchsorted(mesh.y_lines, max(b[3] for b in boxes), 'right')+2, ny)
+
+    # grid points that are not nodes are inside electrodes
+    old_node = mesh.grid >= 0
+    on_el = ~old_node
+    on_el[old_node] = mesh.on_el
+    el_index = np.full((nx, ny), -1, dtype=np.int32)
+    el_index[old_node] = np.append(remap, -1)[mesh.el_index]
+
+    new = copy.copy(mesh)
+    new.geometry = geometry
+    x, y = np.meshgrid(mesh.x_lines[i0:i1], mesh.y_lines[j0:j1], indexing='ij')
+    win_index = geometry.electrode_index(x, y)
+    win_on_el = win_index >= 0
+    is_node = old_node.copy()
+    is_node[i0:i1, j0:j1] = ~win_on_el | new.boundary_mask(x, y, win_on_el, i0, j0)
+    on_el[i0:i1, j0:j1] = win_on_el
+    el_index[i0:i1, j0:j1] = win_index
+
+    node_nr = np.cumsum(is_node.ravel(), dtype=np.int64)-1
+    new.grid = np.where(is_node, node_nr.reshape(is_node.shape), -1).astype(np.int32)
+    i, j = np.nonzero(is_node)
+    new.coords = np.column_stack((mesh.x_lines[i], mesh.y_lines[j]))
+    new.on_el = on_el[is_node]
+    new.el_index = el_index[is_node]
+    new.u_el = np.append(geometry.potentials(), 0.0)[new.el_index]
+    new.elems = new.make_elements(is_node, on_el)
+    new.nodes = ItemList(new, Node, 'coords')
+    new.elements = ItemList(new, Element, 'elems')
+    # the cache entries were for the old geometry
+    new.__dict__.pop('cache_key', None)
+    old_to_new = new.grid[old_node].astype(np.int64)
+    util.toc("Updated the mesh in %d x %d lines: %%.2f s" % (i1-i0, j1-j0),
+             nodes=len(new.coords), elements=len(new.elems))
+    cells = (max(i0-1, 0), min(i1, nx-1), max(j0-1, 0), min(j1, ny-1))
+    return new, old_to_new, cells
+
+def window_elems(mesh, cells, grow=0):
+    i0, i1, j0, j1 = cells
+    nx, ny = mesh.cells.shape[:2]
+    elems = mesh.cells[max(i0-grow, 0):min(i1+grow, nx), max(j0-grow, 0):min(j1+grow, ny)].ravel()
+    return elems[elems >= 0]
+
+def update_matrix(sys, old_mesh, new_mesh, old_to_new, cells, is_axisym):
+    '''
+    The system matrix of new_mesh from the matrix sys of old_mesh.
+    The rows and columns of the nodes of the elements in the window
+    of cells are assembled again, the others are renumbered.
+    Returns the matrix and the mask of the nodes assembled again
+    '''
+    util.tic('assemble')
+    old_win = window_elems(old_mesh, cells)
+    new_win = window_elems(new_mesh, cells)
+    affected = np.zeros(len(new_mesh.coords), dtype=bool)
+    affected[new_mesh.elems[new_win]] = True
+    moved = old_to_new[old_mesh.elems[old_win]]
+    affected[moved[moved >= 0]] = True
+    old_affected = (old_to_new < 0) | affected[old_to_new]
+    old_affected[old_mesh.elems[old_win]] = True
+
+    old = sp.coo_matrix(sys)
+    keep = ~(old_affected[old.row] | old_affected[old.col])
+    # every element with an affected node is next to the window
+    conn = new_mesh.elems[window_elems(new_mesh, cells, grow=1)]
+    if is_axisym:
+        k = element_mats_axisym(new_mesh.coords, conn)[0]
+    else:
+        k = element_mats(new_mesh.coords, conn)[0]
+    rows = np.repeat(conn, 3, axis=1).ravel()
+    cols = np.tile(conn, (1, 3)).ravel()
+    patch = affected[rows] | affected[cols]
+    num_nodes = len(new_mesh.coords)
+    mat = sp.coo_matrix((np.concatenate((old.data[keep], k.ravel()[patch])),
+                         (np.concatenate((old_to_new[old.row[keep]], rows[patch])),
+                          np.concatenate((old_to_new[old.col[keep]], cols[patch])))),
+                        shape=(num_nodes, num_nodes)).tocsr()
+    util.toc("Updated the system matrix for %d nodes: %%0.2f s" % affected.sum(),
+             nodes=num_nodes, elements=len(conn), nnz=mat.nnz)
+    return mat, affected
+
+def free_map(old_free, new_free, old_to_new, num_nodes):
+    '''
+    The new index among new_free of every old free node, -1 if the node
+    was removed or is fixed now
+    '''
+    # the last entry for the removed nodes (old_to_new -1)
+    free_nr = np.full(num_nodes+1, -1, dtype=np.int64)
+    free_nr[new_free] = np.arange(len(new_free))
+    return free_nr[old_to_new[old_free]]
+
+def update_multigrid(mg, mesh, sys_ff, free, fine_map, changed, geometry, remap, boxes):
+    '''
+    The Multigrid of the new fine level (mesh, sys_ff, free) from the
+    hierarchy mg of the old one. fine_map: the new free index of every
+    old free node (see free_map), changed: the new free nodes whose rows
+    of sys_ff were assembled again.
+    Every coarse mesh is rasterized again only in the window of the boxes
+    (update_mesh). The rows of the prolongation are computed again for the
+    fine nodes in the changed coarse cells, the others are renumbered. The
+    Galerkin product is computed again only for the rows and columns of the
+    coarse nodes that a changed prolongation row or matrix row reaches.
+    Returns None when a coarse level has no free nodes left
+    '''
+    util.tic('multigrid')
+    new = copy.copy(mg)
+    new.levels = [multigrid.Level(sys_ff)]
+    new.meshes = [mesh]
+    fine = mesh
+    for nr in range(1, len(mg.levels)):
+        old = mg.meshes[nr]
+        coarse, old_to_new, cells = update_mesh(old, geometry, remap, boxes)
+        coarse_free = np.flatnonzero(~coarse.on_el)
+        if len(coarse_free) == 0:
+            util.toc(None)
+            return None
+        coarse_map = free_map(np.flatnonzero(~old.on_el), coarse_free, old_to_new,
+                              len(coarse.coords))
+
+        # prolongation rows in the changed coarse cells and of the new fine nodes
+        i0, i1, j0, j1 = cells
+        x, y = fine.coords[free].T
+        near = np.flatnonzero((x >= coarse.x_lines[i0]) & (x <= coarse.x_lines[i1]) &
+                              (y >= coarse.y_lines[j0]) & (y <= coarse.y_lines[j1]))
+        i, j = coarse.cell_position(x[near], y[near])[:2]
+        redo = np.zeros(len(free), dtype=bool)
+        redo[near] = (i >= i0) & (i < i1) & (j >= j0) & (j < j1)
+        is_old = np.zeros(len(free), dtype=bool)
+        is_old[fine_map[fine_map >= 0]] = True
+        redo |= ~is_old
+        old_p = mg.levels[nr-1].prolong.tocoo()
+        rows = fine_map[old_p.row]
+        cols = coarse_map[old_p.col]
+        keep = rows >= 0
+        keep[keep] = ~redo[rows[keep]]
+        redo_rows = np.flatnonzero(redo)
+        part = multigrid.prolongation(fine, free[redo_rows], coarse, coarse_free).tocoo()
+        p_data = np.concatenate((old_p.data[keep], part.data))
+        p_row = np.concatenate((rows[keep], redo_rows[part.row]))
+        p_col = np.concatenate((cols[keep], part.col))
+        prolong = sp.csr_matrix((p_data, (p_row, p_col)), shape=(len(free), len(coarse_free)))
+
+        # coarse nodes whose rows of P^T*A*P can differ
+        touched = redo | changed
+        reached = np.zeros(len(coarse_free), dtype=bool)
+        reached[p_col[touched[p_row]]] = True
+        gone = rows < 0
+        gone[~gone] = touched[rows[~gone]]
+        reached[cols[gone & (cols >= 0)]] = True
+        is_old = np.zeros(len(coarse_free), dtype=bool)
+        is_old[coarse_map[coarse_map >= 0]] = True
+        reached |= ~is_old
+        index = np.flatnonzero(reached)
+        # the rows of P^T for the reached nodes, numbered in index
+        nr_in_index = np.cumsum(reached)-1
+        sel = reached[p_col]
+        restrict = sp.csr_matrix((p_data[sel], (nr_in_index[p_col[sel]], p_row[sel])),
+                                 shape=(len(index), len(free)))
+        part = restrict.dot(new.levels[-1].sys).dot(prolong).tocoo()
+        # the columns of the reached nodes are the transposed rows
+        mirror = ~reached[part.col]
+        old_a = mg.levels[nr].sys.tocoo()
+        rows = coarse_map[old_a.row]
+        cols = coarse_map[old_a.col]
+        keep = (rows >= 0) & (cols >= 0)
+        keep[keep] = ~(reached[rows[keep]] | reached[cols[keep]])
+        num = len(coarse_free)
+        sys = sp.csr_matrix((np.concatenate((old_a.data[keep], part.data, part.data[mirror])),
+                             (np.concatenate((rows[keep], index[part.row], part.col[mirror])),
+                              np.concatenate((cols[keep], part.col, index[part.row[mirror]])))),
+                            shape=(num, num))
+        new.levels[-1].prolong = prolong
+        new.levels.append(multigrid.Level(sys))
+        new.meshes.append(coarse)
+        fine, free, fine_map, changed = coarse, coarse_free, coarse_map, reached
+    new.coarse_lu = spla.splu(new.levels[-1].sys.tocsc())
+    util.toc("Updated the multigrid levels: %0.2f s", levels=len(new.levels))
+    return new
+
+def initial_guess(setup, old_setup, old_to_new):
+    '''
+    The previous solution on the free nodes of setup, nodes that are
+    new get the value of the old solution at their position
+    '''
+    u = np.full(len(setup.mesh.coords), np.nan)
+    u[old_to_new[old_to_new >= 0]] = old_setup.u[old_to_new >= 0]
+    missing = np.flatnonzero(np.isnan(u))
+    if len(missing):
+        u[missing] = old_setup.probe_many(*setup.mesh.coords[missing].T)
+    return u[setup.free]
+
+def update_potentials(setup, geometry):
+    '''
+    setup with the potentials of geometry and the same mesh, matrix and
+    factorization. The change of the right hand side comes from the
+    matrix rows of the nodes on the changed electrodes (sys is symmetric)
+    '''
+    util.tic('boundary')
+    mesh = with_potentials(setup.mesh, geometry)
+    new = copy.copy(setup)
+    new.mesh = mesh
+    new.u_c = mesh.u_el[setup.fixed]
+    delta = new.u_c-setup.u_c
+    changed = np.flatnonzero(delta)
+    rows = sp.csr_matrix(setup.sys)[setup.fixed[changed]]
+    new.b_f = setup.b_f-rows.T.dot(delta[changed])[setup.free]
+    util.toc("Updated the boundary conditions for %d nodes: %%0.2f s" % len(changed),
+             free=len(setup.free))
+    return new
+
+def can_update(setup, old, geometry):
+    '''
+    Whether the solution setup of the geometry old (a to_dict) can be
+    updated for geometry: a linear Setup with an assembled sparse matrix
+    on the grid of a Mesh, and the same limits
+    '''
+    return (type(setup) is Setup and isinstance(setup.mesh, Mesh) and
+            sp.issparse(getattr(setup, 'sys', None)) and hasattr(setup, 'u') and
+            old['limits'] == geometry.to_dict()['limits'])
+
+def has_factor(setup, method, options):
+    '''
+    Whether solving setup by method reuses a factorization
+    '''
+    import fem.pcg as pcg
+    import fem.skyline as skyline
+    factor = getattr(setup, 'factor', None)
+    if method == 2:
+        return isinstance(factor, skyline.SkylineMatrix)
+    if method == 4 and options.get('precond') == 'ic0':
+        return isinstance(factor, pcg.IncompleteCholesky)
+    return False
+
+def update(setup, old, geometry, is_axisym, method, warm_precond='mg', **options):
+    '''
+    A new solved Setup for geometry from setup, the solution of the
+    geometry old (its to_dict), see can_update.
+    When only potentials changed and setup has the factorization of method
+    (skyline Cholesky or IC(0)), it's solved again by method with the options
+    of Setup.solve. Otherwise the system is solved by PCG with warm_precond
+    starting from the previous solution, with the tol and maxiter of options.
+    The multigrid preconditioner is the default: the correction of a moved
+    electrode is smooth and reaches the whole domain, which takes single
+    level preconditioners many iterations. Its hierarchy is kept in the
+    setups: used again when only potentials changed, updated in the window
+    of the change (update_multigrid) otherwise
+    '''
+    remap, boxes = electrode_changes(old, geometry)
+    if boxes:
+        mesh, old_to_new, cells = update_mesh(setup.mesh, geometry, remap, boxes)
+        new = Setup(mesh)
+        new.sys, affected = update_matrix(setup.sys, setup.mesh, mesh, old_to_new, cells,
+                                          is_axisym)
+        new.boundary_conditions()
+        if warm_precond == 'mg' and isinstance(setup.factor, multigrid.Multigrid):
+            fine_map = free_map(setup.free, new.free, old_to_new, len(mesh.coords))
+            new.factor = update_multigrid(setup.factor, mesh, new.sys_ff, new.free, fine_map,
+                                          affected[new.free], geometry, remap, boxes)
+        x0 = initial_guess(new, setup, old_to_new)
+    else:
+        new = update_potentials(setup, geometry)
+        if has_factor(setup, method, options):
+            new.solve(method, **options)
+            return new
+        x0 = setup.u[setup.free]
+    new.solve(4, precond=warm_precond, tol=options.get('tol', 1e-8),
+              maxiter=options.get('maxiter'), x0=x0)
+    return new
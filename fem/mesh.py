@@ -3,19 +3,72 @@ Created on 11 Jan 2015
 
 @author: Kristjan
 '''
+import copy
+
 import numpy as np
-import matplotlib.pyplot as plt
 import fem.util as util
 
+def dilate(mask):
+    '''
+    Grows the boolean grid mask by one point in every direction,
+    points outside the grid count as set
+    '''
+    padded = np.pad(mask, 1, mode='constant', constant_values=True)
+    out = mask.copy()
+    nx, ny = mask.shape
+    for di in range(3):
+        for dj in range(3):
+            out |= padded[di:di+nx, dj:dj+ny]
+    return out
+
+def graded_lines(lo, hi, intervals, h_min, h_max, growth=1.2):
+    '''
+    Grid lines from lo to hi (both included) with the spacing
+    h(d) = min(h_max, h_min+(growth-1)*d), d is the distance to the nearest
+    interval [a, b] (0 inside it), so neighbouring cells grow by about the
+    factor growth away from the intervals.
+    The line positions invert the cumulative cell count, the integral
+    of 1/h, sampled at h_min/4
+    '''
+    s = np.linspace(lo, hi, int(np.ceil((hi-lo)/h_min*4))+1)
+    d = np.full(len(s), np.inf)
+    for a, b in intervals:
+        d = np.minimum(d, np.maximum(np.maximum(a-s, s-b), 0))
+    if not intervals:
+        d[:] = np.inf
+    h = np.minimum(h_max, h_min+(growth-1)*d)
+    count = np.concatenate(([0], np.cumsum((1/h[1:]+1/h[:-1])/2*np.diff(s))))
+    num = max(int(np.ceil(count[-1])), 1)
+    lines = np.interp(np.linspace(0, count[-1], num+1), count, s)
+    lines[0] = lo
+    lines[-1] = hi
+    return lines
+
 class Element(object):
     '''
-    The element
+    The element, a view into the connectivity array of the mesh
     '''
-    def __init__(self, a, b, c):
-        self.a = a
-        self.b = b
-        self.c = c
-        self.nodes = [a, b, c]
+    __slots__ = ('mesh', 'nr')
+    
+    def __init__(self, mesh, nr):
+        self.mesh = mesh
+        self.nr = nr
+    
+    @property
+    def a(self):
+        return Node(self.mesh, self.mesh.elems[self.nr, 0])
+    
+    @property
+    def b(self):
+        return Node(self.mesh, self.mesh.elems[self.nr, 1])
+    
+    @property
+    def c(self):
+        return Node(self.mesh, self.mesh.elems[self.nr, 2])
+    
+    @property
+    def nodes(self):
+        return [Node(self.mesh, nr) for nr in self.mesh.elems[self.nr]]
     
     def in_elem(self, x, y):
         '''
@@ -47,81 +100,141 @@ class Element(object):
         return np.linalg.inv(coord).dot(u_nodes)
     
     def draw(self):
-        x = [self.a.x,self.b.x,self.c.x,self.a.x]
-        y = [self.a.y,self.b.y,self.c.y, self.a.y]
-        plt.plot(x, y, 'b')
+        from fem import render
+        render.draw_element(self)
 
 class Node(object):
-    def __init__(self, x, y, nr, on_el, u):
-        self.x = x
-        self.y = y
-        self.nr = nr
-        self.on_el = on_el
-        self.u = u
+    '''
+    The node, a view into the node arrays of the mesh
+    '''
+    __slots__ = ('mesh', 'nr')
+    
+    def __init__(self, mesh, nr):
+        self.mesh = mesh
+        self.nr = int(nr)
+    
+    @property
+    def x(self):
+        return self.mesh.coords[self.nr, 0]
+    
+    @property
+    def y(self):
+        return self.mesh.coords[self.nr, 1]
+    
+    @property
+    def on_el(self):
+        return self.mesh.on_el[self.nr]
+    
+    @property
+    def u(self):
+        return self.mesh.u_el[self.nr]
+
+class ItemList(object):
+    '''
+    Read-only list of Node or Element views
+    '''
+    __slots__ = ('mesh', 'item', 'array')
+    
+    def __init__(self, mesh, item, array):
+        self.mesh = mesh
+        self.item = item
+        self.array = array
+    
+    def __len__(self):
+        return len(getattr(self.mesh, self.array))
+    
+    def __getitem__(self, nr):
+        size = len(self)
+        if nr < 0:
+            nr += size
+        if nr < 0 or nr >= size:
+            raise IndexError("index out of range")
+        return self.item(self.mesh, nr)
+    
+    def __iter__(self):
+        for nr in range(len(self)):
+            yield self.item(self.mesh, nr)
+
+def with_potentials(mesh, geometry):
+    '''
+    A copy of mesh for geometry, the same electrodes at other potentials.
+    The arrays other than u_el are shared, the node and element views
+    are new
+    '''
+    new = copy.copy(mesh)
+    new.geometry = geometry
+    new.u_el = np.append(geometry.potentials(), 0.0)[mesh.el_index]
+    if hasattr(mesh, 'nodes'):
+        new.nodes = ItemList(new, Node, 'coords')
+    if hasattr(mesh, 'elements'):
+        new.elements = ItemList(new, Element, 'elems')
+    return new
 
 class Mesh(object):
     '''
-    classdocs
+    The mesh is stored as arrays:
+    coords (n,2) node coordinates, elems (m,3) node numbers of the elements,
+    on_el (n,) whether the node is on an electrode, el_index (n,) the index
+    of that electrode in geometry.electrodes (-1 if none) and u_el (n,)
+    its potential.
+    nodes and elements give Node/Element views into them.
+    The grid lines are x_lines, y_lines: uniform with the steps x_step,
+    y_step, or graded when given as the arrays x, y (the steps are then None)
     '''
-    def __init__(self, geometry, x_step, y_step):
+    def __init__(self, geometry, x_step=None, y_step=None, x=None, y=None):
         self.geometry=geometry
-        self.x_step = x_step
-        self.y_step = y_step
-        self.elements=[]
-        self.nodes=[]
-        self.num_nodes_x = int((geometry.x_max-geometry.x_min)/x_step)+2
-        self.num_nodes_y = int((geometry.y_max-geometry.y_min)/y_step)+2
-        self.grid=np.zeros((self.num_nodes_x, self.num_nodes_y), dtype=np.int)
-        self.grid= self.grid-1
+        self.x_step = None if x is not None else x_step
+        self.y_step = None if y is not None else y_step
+        if x is not None:
+            self.x_lines = np.unique(np.asarray(x, dtype=np.float64))
+        else:
+            num = int((geometry.x_max-geometry.x_min)/x_step)+2
+            self.x_lines = np.arange(num, dtype=np.float64)*x_step+geometry.x_min
+        if y is not None:
+            self.y_lines = np.unique(np.asarray(y, dtype=np.float64))
+        else:
+            num = int((geometry.y_max-geometry.y_min)/y_step)+2
+            self.y_lines = np.arange(num, dtype=np.float64)*y_step+geometry.y_min
+        self.coords = np.zeros((0, 2))
+        self.elems = np.zeros((0, 3), dtype=np.int32)
+        self.on_el = np.zeros(0, dtype=bool)
+        self.el_index = np.zeros(0, dtype=np.int32)
+        self.u_el = np.zeros(0)
+        self.nodes = ItemList(self, Node, 'coords')
+        self.elements = ItemList(self, Element, 'elems')
+        self.num_nodes_x = len(self.x_lines)
+        self.num_nodes_y = len(self.y_lines)
+        self.grid = np.full((self.num_nodes_x, self.num_nodes_y), -1, dtype=np.int32)
+        # element numbers of the two triangles of every grid cell, -1 if none
+        self.cells = np.full((self.num_nodes_x-1, self.num_nodes_y-1, 2), -1, dtype=np.int32)
+    
+    @staticmethod
+    def graded(geometry, h_min, h_max, growth=1.2):
+        '''
+        Mesh with the lines clustered at spacing h_min around the electrodes
+        and coarsening towards h_max away from them, see graded_lines
+        '''
+        bounds = [el.bounds() for el in geometry.electrodes]
+        x = graded_lines(geometry.x_min, geometry.x_max, [b[:2] for b in bounds],
+                         h_min, h_max, growth)
+        y = graded_lines(geometry.y_min, geometry.y_max, [b[2:] for b in bounds],
+                         h_min, h_max, growth)
+        return Mesh(geometry, x=x, y=y)
+    
+    def coarse(self):
+        '''
+        Mesh with every other grid line (double steps), for multigrid
+        '''
+        x = None if self.x_step is not None else np.append(self.x_lines[::2], self.x_lines[-1])
+        y = None if self.y_step is not None else np.append(self.y_lines[::2], self.y_lines[-1])
+        return Mesh(self.geometry, 2*(self.x_step or 0), 2*(self.y_step or 0), x, y)
         
     def generate_mesh(self):
-        util.tic()
-        node_nr = 0;
-        for i in range(self.num_nodes_x):
-            for j in range(self.num_nodes_y):
-                x = i*self.x_step+self.geometry.x_min
-                y = j*self.y_step+self.geometry.y_min
-                is_el = self.geometry.is_electrode(x, y)
-                if not is_el[0] or self.is_boundary(x, y):
-                    node = Node(x, y, node_nr, is_el[0], is_el[1])
-                    self.nodes.append(node)
-                    self.grid[i,j] = node_nr
-                    node_nr = node_nr + 1
-                    self.make_elements(i, j)
-        util.toc("Generating mesh: %.2f s")
-        print("Num. of nodes: ", len(self.nodes))
-        print("Num. of elements: ", len(self.elements))
-    
-    def make_elements(self, i, j):
-        '''
-        for the input node, tries to add two elements (bottom left ones)
-        first checks that the positions have nodes
-        then checks that at least one node is not on an electrode
         '''
-        if i <= 0 or j <= 0:
-            return
-        
-        on_el00 = self.nodes[self.grid[i,j]].on_el
-        on_el10 = self.nodes[self.grid[i-1,j]].on_el
-        on_el01 = self.nodes[self.grid[i,j-1]].on_el
-        on_el11 = self.nodes[self.grid[i-1,j-1]].on_el
-        
-        if (self.grid[i,j-1] >= 0 and self.grid[i-1,j-1] >= 0 and
-                not (on_el00 and on_el01 and on_el11)):
-            a = self.nodes[self.grid[i, j]]
-            b = self.nodes[self.grid[i-1, j-1]]
-            c = self.nodes[self.grid[i, j-1]]
-            self.elements.append(Element(a, b, c))
-        if (self.grid[i-1,j] >= 0 and self.grid[i-1,j-1] >= 0 and
-                not (on_el00 and on_el10 and on_el11)):
-            a = self.nodes[self.grid[i, j]]
-            b = self.nodes[self.grid[i-1, j]]
-            c = self.nodes[self.grid[i-1, j-1]]
-            self.elements.append(Element(a, b, c))
-    
-    def is_boundary(self, x, y):
-        '''
-        check if relevant neighbours are inside the electrode
+        Rasterizes the electrodes on the whole grid at once.
+        A grid point is a node if it is not on an electrode or if it is on the
+        electrode boundary. Nodes are numbered column by column (i, then j) and
+        every node (i,j) gets the two elements of the cell on its bottom left
         mesh structure:
         *-----*
         |    /|
@@ -129,41 +242,235 @@ class Mesh(object):
         |/    |
         *-----*
         '''
+        util.tic('mesh')
+        x, y = np.meshgrid(self.x_lines, self.y_lines, indexing='ij')
+        el_index = self.geometry.electrode_index(x, y)
+        on_el = el_index >= 0
+        u_el = np.append(self.geometry.potentials(), 0.0)[el_index]
+        util.progress(1, 3)
+        
+        is_node = ~on_el | self.boundary_mask(x, y, on_el)
+        util.progress(2, 3)
+        node_nr = np.cumsum(is_node.ravel(), dtype=np.int64)-1
+        self.grid = np.where(is_node, node_nr.reshape(is_node.shape), -1).astype(np.int32)
+        self.coords = np.column_stack((x[is_node], y[is_node]))
+        self.on_el = on_el[is_node]
+        self.el_index = el_index[is_node]
+        self.u_el = u_el[is_node]
+        
+        self.elems = self.make_elements(is_node, on_el)
+        util.toc("Generating mesh: %.2f s", nodes=len(self.coords), elements=len(self.elems))
+        util.log("Num. of nodes: ", len(self.nodes))
+        util.log("Num. of elements: ", len(self.elements))
+    
+    def make_elements(self, is_node, on_el):
+        '''
+        for every node, tries to add two elements (bottom left ones)
+        first checks that the positions have nodes
+        then checks that at least one node is not on an electrode
+        '''
+        g = self.grid
+        n00 = is_node[1:, 1:]
+        n10 = is_node[:-1, 1:]
+        n01 = is_node[1:, :-1]
+        n11 = is_node[:-1, :-1]
+        e00 = on_el[1:, 1:]
+        e10 = on_el[:-1, 1:]
+        e01 = on_el[1:, :-1]
+        e11 = on_el[:-1, :-1]
+        valid = np.empty(n00.shape+(2,), dtype=bool)
+        valid[..., 0] = n00 & n01 & n11 & ~(e00 & e01 & e11)
+        valid[..., 1] = n00 & n10 & n11 & ~(e00 & e10 & e11)
+        
+        self.cells = np.where(valid, np.cumsum(valid.ravel()).reshape(valid.shape)-1,
+                              -1).astype(np.int32)
+        i, j, k = np.nonzero(valid)
+        i += 1
+        j += 1
+        elems = np.empty((len(i), 3), dtype=np.int32)
+        elems[:, 0] = g[i, j]
+        elems[:, 1] = np.where(k == 0, g[i-1, j-1], g[i-1, j])
+        elems[:, 2] = np.where(k == 0, g[i, j-1], g[i-1, j-1])
+        return elems
+    
+    def cell_position(self, x, y):
+        '''
+        Grid cell (i, j) of the points (x,y) and the position (fx, fy)
+        inside it, 0..1 from its lower left corner, and whether the points
+        are inside the grid. The cell is found from the steps in constant
+        time, or by bisection of the lines of a graded grid
+        '''
+        x, y = np.broadcast_arrays(np.asarray(x, dtype=float), np.asarray(y, dtype=float))
+        i, fx, in_x = self.line_position(x, self.x_lines, self.x_step)
+        j, fy, in_y = self.line_position(y, self.y_lines, self.y_step)
+        return i, j, fx, fy, in_x & in_y
+    
+    @staticmethod
+    def line_position(x, lines, step):
+        if step is not None:
+            f = (x-lines[0])/step
+            inside = (f >= 0) & (f <= len(lines)-1)
+            i = np.clip(np.floor(np.where(inside, f, 0)).astype(np.int64), 0, len(lines)-2)
+            return i, f-i, inside
+        inside = (x >= lines[0]) & (x <= lines[-1])
+        i = np.clip(np.searchsorted(lines, x, side='right')-1, 0, len(lines)-2)
+        return i, (x-lines[i])/(lines[i+1]-lines[i]), inside
+    
+    def locate(self, x, y):
+        '''
+        Element numbers of the points (x,y): the grid cell is found by
+        cell_position and the triangle from the position inside the cell.
+        -1 for points outside the grid or in cells without that element
+        (inside electrodes)
+        '''
+        i, j, fx, fy, inside = self.cell_position(x, y)
+        # element 0 of the cell is the lower right triangle, 1 the upper left one
+        upper = fy > fx
+        return np.where(inside, self.cells[i, j, upper.astype(np.int64)], -1)
+    
+    def boundary_mask(self, x, y, on_el, i0=0, j0=0):
+        '''
+        check if relevant neighbours are outside the electrodes
+        Only electrode points near a non-electrode grid point can be on the
+        boundary, these are found by shifting the mask. Their neighbours are
+        then checked at x-x_step etc., so rounding is the same as for a
+        single point. On a graded grid they are the neighbouring lines.
+        x, y can be a window of the grid starting at the lines i0, j0
+        '''
         x_min = self.geometry.x_min
         x_max = self.geometry.x_max
         y_min = self.geometry.y_min
         y_max = self.geometry.y_max
         
-        xm = x - self.x_step
-        xp = x + self.x_step
-        ym = y - self.y_step
-        yp = y + self.y_step
+        cand = on_el & dilate(dilate(~on_el))
+        i, j = np.nonzero(cand)
+        i += i0
+        j += j0
+        x = x[cand]
+        y = y[cand]
+        if self.x_step is None:
+            # the lines beyond the ends are out of the domain
+            lines = np.concatenate(([-np.inf], self.x_lines, [np.inf]))
+            xm = lines[i]
+            xp = lines[i+2]
+        else:
+            xm = x - self.x_step
+            xp = x + self.x_step
+        if self.y_step is None:
+            lines = np.concatenate(([-np.inf], self.y_lines, [np.inf]))
+            ym = lines[j]
+            yp = lines[j+2]
+        else:
+            ym = y - self.y_step
+            yp = y + self.y_step
         
-        if xm >= x_min and not self.geometry.is_electrode(xm, y)[0]:
-            return True
-        if xp <= x_max and not self.geometry.is_electrode(xp, y)[0]:
-            return True
-        if ym >= y_min and not self.geometry.is_electrode(x, ym)[0]:
-            return True
-        if yp <= y_max and not self.geometry.is_electrode(x, yp)[0]:
-            return True
-        if xp <= x_max and yp <= y_max and not self.geometry.is_electrode(xp, yp)[0]:
-            return True
-        if xm >= x_min and ym >= y_min and not self.geometry.is_electrode(xm, ym)[0]:
-            return True
-        return False
+        neighbours = ((xm, y, xm >= x_min),
+                      (xp, y, xp <= x_max),
+                      (x, ym, ym >= y_min),
+                      (x, yp, yp <= y_max),
+                      (xp, yp, (xp <= x_max) & (yp <= y_max)),
+                      (xm, ym, (xm >= x_min) & (ym >= y_min)))
+        bnd = np.zeros(len(x), dtype=bool)
+        for xn, yn, in_domain in neighbours:
+            bnd |= in_domain & ~self.geometry.electrode_mask(xn, yn)[0]
+        mask = np.zeros(on_el.shape, dtype=bool)
+        mask[cand] = bnd
+        return mask
     
     def draw(self, nodes_or_mesh):
-        util.tic()
-        if nodes_or_mesh:
-            x=[]
-            y=[]
-            for node in self.nodes:
-                x.append(node.x)
-                y.append(node.y)
-            plt.scatter(x, y, 3, zorder=2)
-        else:
-            for el in self.elements:
-                el.draw()
-        util.toc("Drawing mesh: %.2f s")
-        
\ No newline at end of file
+        from fem import render
+        render.draw_mesh(self, nodes_or_mesh)
+        
+class TriMesh(object):
+    '''
+    Mesh with arbitrary triangle connectivity, as made by fem.adapt.
+    Has the same node and element arrays as Mesh (coords, elems, on_el,
+    el_index, u_el), but no grid: points are located with a bucket grid
+    over the element bounding boxes instead
+    '''
+    def __init__(self, geometry, coords, elems, el_index):
+        self.geometry = geometry
+        self.coords = np.asarray(coords, dtype=np.float64)
+        self.elems = np.asarray(elems, dtype=np.int32)
+        self.el_index = np.asarray(el_index, dtype=np.int32)
+        self.on_el = self.el_index >= 0
+        self.u_el = np.append(geometry.potentials(), 0.0)[self.el_index]
+        self.nodes = ItemList(self, Node, 'coords')
+        self.elements = ItemList(self, Element, 'elems')
+        self.bucket_ptr = None
+    
+    @staticmethod
+    def from_mesh(mesh):
+        return TriMesh(mesh.geometry, mesh.coords, mesh.elems, mesh.el_index)
+    
+    def make_buckets(self):
+        '''
+        Bucket grid of about one bucket per element. Every element is listed
+        in the buckets its bounding box overlaps, as a CSR structure
+        (bucket_ptr, bucket_elems)
+        '''
+        p = self.coords[self.elems]
+        lo = p.min(axis=1)
+        hi = p.max(axis=1)
+        self.b_min = self.coords.min(axis=0)
+        extent = np.maximum(self.coords.max(axis=0)-self.b_min, 1e-300)
+        self.b_num = max(int(np.sqrt(len(self.elems))), 1)
+        self.b_size = extent/self.b_num
+        i0, j0 = self.bucket_ij(lo).T
+        i1, j1 = self.bucket_ij(hi).T
+        ni = i1-i0+1
+        nj = j1-j0+1
+        count = ni*nj
+        elem = np.repeat(np.arange(len(self.elems)), count)
+        # position of each copy inside the bounding box of its element
+        k = np.arange(count.sum())-np.repeat(np.cumsum(count)-count, count)
+        bi = np.repeat(i0, count)+k//np.repeat(nj, count)
+        bj = np.repeat(j0, count)+k%np.repeat(nj, count)
+        bucket = bi*self.b_num+bj
+        order = np.argsort(bucket, kind='stable')
+        self.bucket_elems = elem[order]
+        self.bucket_ptr = np.zeros(self.b_num*self.b_num+1, dtype=np.int64)
+        np.cumsum(np.bincount(bucket, minlength=self.b_num*self.b_num), out=self.bucket_ptr[1:])
+    
+    def bucket_ij(self, points):
+        ij = np.floor((points-self.b_min)/self.b_size).astype(np.int64)
+        return np.clip(ij, 0, self.b_num-1)
+    
+    def locate(self, x, y):
+        '''
+        Element numbers of the points (x,y), -1 if not in any element.
+        The candidates are the elements listed in the bucket of the point
+        '''
+        if self.bucket_ptr is None:
+            self.make_buckets()
+        x, y = np.broadcast_arrays(np.asarray(x, dtype=float), np.asarray(y, dtype=float))
+        shape = x.shape
+        x = x.ravel()
+        y = y.ravel()
+        result = np.full(len(x), -1, dtype=np.int64)
+        ij = self.bucket_ij(np.column_stack((x, y)))
+        bucket = ij[:, 0]*self.b_num+ij[:, 1]
+        pos = self.bucket_ptr[bucket]
+        end = self.bucket_ptr[bucket+1]
+        active = np.flatnonzero(pos < end)
+        eps = 1e-12
+        while len(active) > 0:
+            el = self.bucket_elems[pos[active]]
+            p = self.coords[self.elems[el]]
+            xa = x[active]
+            ya = y[active]
+            p0x, p0y = p[:, 0, 0], p[:, 0, 1]
+            p1x, p1y = p[:, 1, 0], p[:, 1, 1]
+            p2x, p2y = p[:, 2, 0], p[:, 2, 1]
+            area2 = -p1y*p2x + p0y*(-p1x + p2x) + p0x*(p1y - p2y) + p1x*p2y
+            s = (p0y*p2x - p0x*p2y + (p2y - p0y)*xa + (p0x - p2x)*ya)/area2
+            t = (p0x*p1y - p0y*p1x + (p0y - p1y)*xa + (p1x - p0x)*ya)/area2
+            inside = (s >= -eps) & (t >= -eps) & (1-s-t >= -eps)
+            result[active[inside]] = el[inside]
+            pos[active] += 1
+            active = active[~inside & (pos[active] < end[active])]
+        return result.reshape(shape)
+    
+    def draw(self, nodes_or_mesh):
+        from fem import render
+        render.draw_mesh(self, nodes_or_mesh)
@@ -0,0 +1,148 @@
+'''
+Geometric multigrid for the structured grid of Mesh
+'''
+import numpy as np
+import scipy.sparse as sp
+import scipy.sparse.linalg as spla
+import fem.util as util
+
+def prolongation(fine, fine_free, coarse, coarse_free):
+    '''
+    Linear interpolation from the free nodes of the coarse mesh to the free
+    nodes of the fine one, on the triangles of the coarse grid.
+    Coarse nodes that are fixed or missing (inside electrodes) contribute zero
+    '''
+    x = fine.coords[fine_free, 0]
+    y = fine.coords[fine_free, 1]
+    i, j, fx, fy, _ = coarse.cell_position(x, y)
+    fx = np.clip(fx, 0, 1)
+    fy = np.clip(fy, 0, 1)
+    lower = fx >= fy
+    # lower right triangle (i,j), (i+1,j), (i+1,j+1)
+    # upper left triangle (i,j), (i,j+1), (i+1,j+1)
+    ci = np.column_stack((i, i+lower, i+1))
+    cj = np.column_stack((j, j+~lower, j+1))
+    w = np.where(lower[:, None],
+                 np.column_stack((1-fx, fx-fy, fy)),
+                 np.column_stack((1-fy, fy-fx, fx)))
+    # coarse node number -> index among the free coarse nodes
+    free_nr = np.full(len(coarse.coords), -1, dtype=np.int64)
+    free_nr[coarse_free] = np.arange(len(coarse_free))
+    node = coarse.grid[ci, cj]
+    col = np.where(node >= 0, free_nr[node], -1)
+    keep = (col >= 0) & (w > 0)
+    row = np.repeat(np.arange(len(fine_free)), 3).reshape(-1, 3)
+    return sp.csr_matrix((w[keep], (row[keep], col[keep])),
+                         shape=(len(fine_free), len(coarse_free)))
+
+class Level(object):
+    def __init__(self, sys_ff):
+        self.sys = sp.csr_matrix(sys_ff)
+        self.inv_diag = 1/self.sys.diagonal()
+        self.prolong = None
+        self.lam_max = None
+
+class Multigrid(object):
+    '''
+    V-cycle multigrid on a hierarchy of meshes made by doubling the steps
+    (every other line of a graded grid) and re-rasterizing the electrodes.
+    The coarse matrices are the Galerkin products P^T*A*P. Can be used on
+    its own (iterate) or as a PCG preconditioner (solve), the V-cycle is
+    symmetric.
+    smoother: 'jacobi' (damped) or 'chebyshev' (Jacobi preconditioned)
+    The point smoothers are slow on the stretched cells of a strongly
+    graded grid, there it works better as the PCG preconditioner
+    '''
+    def __init__(self, mesh, sys_ff, free, smoother='jacobi', n_smooth=2,
+                 omega=2/3, min_nodes=1000, max_levels=12):
+        self.smoother = smoother
+        self.n_smooth = n_smooth
+        self.omega = omega
+        self.levels = [Level(sys_ff)]
+        self.meshes = [mesh]
+        while (len(self.levels) < max_levels and len(free) > min_nodes and
+               mesh.num_nodes_x > 3 and mesh.num_nodes_y > 3):
+            coarse = mesh.coarse()
+            coarse.generate_mesh()
+            coarse_free = np.flatnonzero(~coarse.on_el)
+            if len(coarse_free) == 0:
+                break
+            level = self.levels[-1]
+            level.prolong = prolongation(mesh, free, coarse, coarse_free)
+            self.levels.append(Level(level.prolong.T.dot(level.sys).dot(level.prolong)))
+            self.meshes.append(coarse)
+            mesh = coarse
+            free = coarse_free
+        self.coarse_lu = spla.splu(self.levels[-1].sys.tocsc())
+        util.log("Multigrid levels, unknowns:", [lv.sys.shape[0] for lv in self.levels])
+
+    def smooth(self, level, b, x):
+        if self.smoother == 'chebyshev':
+            return self.chebyshev(level, b, x)
+        for _ in range(self.n_smooth):
+            x = x + self.omega*level.inv_diag*(b-level.sys.dot(x))
+        return x
+
+    def chebyshev(self, level, b, x):
+        '''
+        Chebyshev iteration for D^-1*A on [lam_max/10, 1.1*lam_max]
+        '''
+        if level.lam_max is None:
+            v = np.random.RandomState(0).rand(level.sys.shape[0])-0.5
+            for _ in range(10):
+                v = level.inv_diag*level.sys.dot(v)
+                lam = np.linalg.norm(v)
+                v /= lam
+            level.lam_max = lam
+        upper = 1.1*level.lam_max
+        lower = level.lam_max/10
+        theta = (upper+lower)/2
+        delta = (upper-lower)/2
+        sigma = theta/delta
+        rho = 1/sigma
+        r = b-level.sys.dot(x)
+        d = level.inv_diag*r/theta
+        for k in range(self.n_smooth):
+            x = x + d
+            if k == self.n_smooth-1:
+                break
+            r = r-level.sys.dot(d)
+            rho_new = 1/(2*sigma-rho)
+            d = rho_new*rho*d + 2*rho_new/delta*level.inv_diag*r
+            rho = rho_new
+        return x
+
+    def vcycle(self, nr, b, x):
+        level = self.levels[nr]
+        if nr == len(self.levels)-1:
+            return self.coarse_lu.solve(b)
+        x = self.smooth(level, b, x)
+        r = b-level.sys.dot(x)
+        e = self.vcycle(nr+1, level.prolong.T.dot(r), np.zeros(level.prolong.shape[1]))
+        x = x + level.prolong.dot(e)
+        return self.smooth(level, b, x)
+
+    def solve(self, r):
+        '''
+        One V-cycle from zero, the preconditioner interface of fem.pcg
+        '''
+        return self.vcycle(0, r, np.zeros(len(r)))
+
+    def iterate(self, b, x0=None, tol=1e-8, maxiter=100):
+        '''
+        Repeats V-cycles until |r|/|b| < tol
+        Returns the solution and the relative residual norms
+        '''
+        norm_b = np.linalg.norm(b)
+        if norm_b == 0:
+            return np.zeros(len(b)), [0.0]
+        x = np.zeros(len(b)) if x0 is None else np.array(x0, dtype=float)
+        sys = self.levels[0].sys
+        residuals = [np.linalg.norm(b-sys.dot(x))/norm_b]
+        for _ in range(maxiter):
+            if residuals[-1] < tol:
+                break
+            x = self.vcycle(0, b, x)
+            residuals.append(np.linalg.norm(b-sys.dot(x))/norm_b)
+            util.progress(np.log(residuals[0]/residuals[-1]), np.log(residuals[0]/tol))
+        return x, residuals
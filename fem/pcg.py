@@ -0,0 +1,116 @@
+'''
+Preconditioned conjugate gradient method and its preconditioners
+'''
+import math
+import numpy as np
+import scipy.sparse as sp
+import scipy.sparse.linalg as spla
+import fem.util as util
+
+def pcg(mat, b, precond=None, x0=None, tol=1e-8, maxiter=None):
+    '''
+    Solves mat*x = b for a symmetric positive definite mat
+    mat: matrix or operator with a dot method
+    precond: preconditioner with a solve method (r -> M^-1*r) or None
+    Stops when |r|/|b| < tol or after maxiter iterations
+    Returns the solution and the relative residual norms per iteration
+    '''
+    n = len(b)
+    if maxiter is None:
+        maxiter = max(n, 1)
+    norm_b = np.linalg.norm(b)
+    if norm_b == 0:
+        return np.zeros(n), [0.0]
+    if x0 is None:
+        x = np.zeros(n)
+        r = np.array(b, dtype=float)
+    else:
+        x = np.array(x0, dtype=float)
+        r = b-mat.dot(x)
+    residuals = [np.linalg.norm(r)/norm_b]
+    z = precond.solve(r) if precond is not None else r
+    p = z.copy()
+    rz = r.dot(z)
+    for _ in range(maxiter):
+        if residuals[-1] < tol:
+            break
+        q = mat.dot(p)
+        alpha = rz/p.dot(q)
+        x += alpha*p
+        r -= alpha*q
+        residuals.append(np.linalg.norm(r)/norm_b)
+        # digits of the residual reduction done out of those needed
+        util.progress(np.log(residuals[0]/residuals[-1]), np.log(residuals[0]/tol))
+        z = precond.solve(r) if precond is not None else r
+        rz_new = r.dot(z)
+        p *= rz_new/rz
+        p += z
+        rz = rz_new
+    return x, residuals
+
+class Jacobi(object):
+    '''
+    Diagonal preconditioner
+    '''
+    def __init__(self, diagonal):
+        self.inv_diag = 1/np.asarray(diagonal, dtype=float)
+
+    def solve(self, r):
+        return self.inv_diag*r
+
+class IncompleteCholesky(object):
+    '''
+    IC(0) preconditioner: L*L^T ~ mat, L has the non-zero pattern
+    of the lower triangle of mat. A factor low computed before can be
+    given instead of mat. The factorization is a loop over the rows,
+    slow for large matrices
+    '''
+    def __init__(self, mat, low=None):
+        if low is None:
+            low = self.factorize(mat)
+        self.low = sp.csc_matrix(low)
+        # LU of a triangular matrix in natural order has no fill, it's only
+        # used for its fast triangular solves
+        self.lu = spla.splu(self.low, permc_spec='NATURAL',
+                            diag_pivot_thresh=0, options=dict(SymmetricMode=True))
+
+    @staticmethod
+    def factorize(mat):
+        low = sp.tril(sp.csr_matrix(mat), format='csr')
+        low.eliminate_zeros()
+        low.sum_duplicates()
+        low.sort_indices()
+        bad = np.flatnonzero(low.diagonal() <= 0)
+        if len(bad):
+            raise ValueError("IC(0) needs a symmetric positive definite matrix, "
+                             "row %d has the diagonal %g" % (bad[0], low.diagonal()[bad[0]]))
+        indptr = low.indptr.tolist()
+        indices = low.indices.tolist()
+        data = low.data.tolist()
+        for i in range(low.shape[0]):
+            if i % 256 == 0:
+                util.progress(i, low.shape[0])
+            start = indptr[i]
+            end = indptr[i+1]-1 # the diagonal is the last entry of the row
+            # columns of row i computed so far and their values
+            row = {}
+            for p in range(start, end):
+                j = indices[p]
+                s = data[p]
+                for q in range(indptr[j], indptr[j+1]-1):
+                    k = indices[q]
+                    if k in row:
+                        s -= row[k]*data[q]
+                s /= data[indptr[j+1]-1]
+                row[j] = s
+                data[p] = s
+            d = data[end]-sum(v*v for v in row.values())
+            if d <= 0:
+                # breakdown, keep the original diagonal
+                d = data[end]
+            data[end] = math.sqrt(d)
+        return sp.csr_matrix((np.array(data), low.indices, low.indptr), shape=low.shape)
+
+    def solve(self, r):
+        y = self.lu.solve(r)
+        return self.lu.solve(y, trans='T')
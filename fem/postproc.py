@@ -0,0 +1,37 @@
+'''
+Electrode charges, field energy and the capacitance matrix.
+With beta (the permittivity) 1 as in Setup, the charges are per unit
+permittivity and, in planar mode, per unit length
+'''
+import numpy as np
+
+def charges(setup, u=None):
+    '''
+    Charge of every electrode in geometry.electrodes: the reaction K*u on
+    the fixed nodes, summed per electrode. u can be (n,) or (n, k) for k
+    solutions at once, the result is then (num_el,) or (num_el, k)
+    '''
+    mesh = setup.mesh
+    u = setup.u if u is None else u
+    r = setup.sys.dot(u)[setup.fixed]
+    index = mesh.el_index[setup.fixed]
+    num_el = len(mesh.geometry.electrodes)
+    if np.ndim(r) == 1:
+        return np.bincount(index, r, minlength=num_el)
+    return np.column_stack([np.bincount(index, col, minlength=num_el) for col in np.asarray(r).T])
+
+def energy(setup, u=None):
+    '''
+    Electrostatic energy u^T*K*u/2
+    '''
+    u = setup.u if u is None else u
+    return 0.5*u.dot(setup.sys.dot(u))
+
+def capacitance_matrix(sweep):
+    '''
+    Maxwell capacitance matrix C, C[i,j] is the charge of electrode i with
+    1 V on electrode j and 0 V on the others. Uses the basis solutions of
+    a fem.sweep.Sweep, so all columns share its assembly and factorization.
+    The charges for voltages V are C*V and the energy V^T*C*V/2
+    '''
+    return charges(sweep.setup, sweep.basis)
@@ -0,0 +1,250 @@
+'''
+Quadratic (P2) triangular elements
+
+Every triangle of a linear mesh (Mesh or TriMesh) gets a node at the middle
+of each edge, the potential inside it is a second order polynomial of x and
+y. The element matrices are integrated with a 6 point rule of degree 4,
+exact for both the planar and the axisymmetric (weight 2*pi*r) integrand.
+'''
+import numpy as np
+import scipy.sparse as sp
+import fem.util as util
+from fem.adapt import edge_table
+from fem.mesh import ItemList, Node
+from fem.setup import Setup, element_coefs
+
+# Dunavant's rule of degree 4: barycentric coordinates and weights
+# (the weights sum to 1, multiplied by the area)
+QUAD_POINTS = np.array([[0.108103018168070, 0.445948490915965, 0.445948490915965],
+                        [0.445948490915965, 0.108103018168070, 0.445948490915965],
+                        [0.445948490915965, 0.445948490915965, 0.108103018168070],
+                        [0.816847572980459, 0.091576213509771, 0.091576213509771],
+                        [0.091576213509771, 0.816847572980459, 0.091576213509771],
+                        [0.091576213509771, 0.091576213509771, 0.816847572980459]])
+QUAD_WEIGHTS = np.array([0.223381589678011]*3 + [0.109951743655322]*3)
+# barycentric coordinates of the 6 nodes of an element
+NODE_POINTS = np.array([[1, 0, 0], [0, 1, 0], [0, 0, 1],
+                        [0.5, 0.5, 0], [0, 0.5, 0.5], [0.5, 0, 0.5]])
+
+def shape_values(L):
+    '''
+    The 6 shape functions at barycentric coordinates L (..., 3):
+    vertices L_i*(2*L_i-1), then the middles of the edges
+    ab, bc, ca 4*L_i*L_j
+    '''
+    L1, L2, L3 = L[..., 0], L[..., 1], L[..., 2]
+    return np.stack((L1*(2*L1-1), L2*(2*L2-1), L3*(2*L3-1),
+                     4*L1*L2, 4*L2*L3, 4*L3*L1), axis=-1)
+
+def shape_gradients(L, grad_L):
+    '''
+    Gradients (m, 6, 2) of the shape functions at the barycentric
+    coordinates L (m, 3) or (3,), grad_L (m, 3, 2) are the constant
+    gradients of the barycentric coordinates
+    '''
+    L = np.broadcast_to(L, grad_L.shape[:2])[..., None]
+    g1, g2, g3 = grad_L[:, 0], grad_L[:, 1], grad_L[:, 2]
+    L1, L2, L3 = L[:, 0], L[:, 1], L[:, 2]
+    return np.stack(((4*L1-1)*g1, (4*L2-1)*g2, (4*L3-1)*g3,
+                     4*(L1*g2+L2*g1), 4*(L2*g3+L3*g2), 4*(L3*g1+L1*g3)), axis=1)
+
+def barycentric_gradients(coords, conn):
+    '''
+    Gradients of L_i, (b_i, c_i)/(2*S), book p. 104, and the areas S
+    '''
+    b, c, S = element_coefs(coords, conn)
+    return np.stack((b, c), axis=-1)/(2*S)[:, None, None], S
+
+def element_mats_p2(coords, conn, is_axisym, beta=1):
+    '''
+    Stiffness matrices (n_elem, 6, 6) of the quadratic elements conn
+    (n_elem, 6), the first 3 columns are the vertices
+    '''
+    grad_L, S = barycentric_gradients(coords, conn[:, :3])
+    x = coords[conn[:, :3], 0]
+    K = np.zeros((len(conn), 6, 6))
+    for L, w in zip(QUAD_POINTS, QUAD_WEIGHTS):
+        G = shape_gradients(L, grad_L)
+        f = beta*w*np.abs(S)
+        if is_axisym:
+            f = f*2*np.pi*x.dot(L)
+        K += np.einsum('mik,mjk->mij', G, G)*f[:, None, None]
+    return K
+
+class QuadraticMesh(object):
+    '''
+    The nodes of a linear mesh plus one node in the middle of every edge.
+    Has the node arrays of Mesh (coords, on_el, el_index, u_el), elems is
+    (m, 6): the vertices as in linear.elems, then the middles of the edges
+    ab, bc and ca. The new nodes are numbered after the vertices and are
+    assigned to electrodes by the geometry. Points are located
+    with the linear mesh
+    '''
+    def __init__(self, linear):
+        self.linear = linear
+        self.geometry = linear.geometry
+        elems = linear.elems.astype(np.int64)
+        edges, elem_edges = edge_table(elems)
+        num_vertices = len(linear.coords)
+        mid = linear.coords[edges].mean(axis=1)
+        self.coords = np.concatenate((linear.coords, mid))
+        self.elems = np.concatenate((elems, num_vertices+elem_edges), axis=1).astype(np.int32)
+        self.el_index = np.concatenate((linear.el_index,
+                                        self.geometry.electrode_index(mid[:, 0], mid[:, 1])))
+        self.on_el = self.el_index >= 0
+        self.u_el = np.append(self.geometry.potentials(), 0.0)[self.el_index]
+        self.nodes = ItemList(self, Node, 'coords')
+
+    def locate(self, x, y):
+        return self.linear.locate(x, y)
+
+    def split_elems(self):
+        '''
+        Every element split in 4 linear triangles at the middle nodes,
+        (4m, 3), for plotting
+        '''
+        a, b, c, ab, bc, ca = self.elems.T
+        return np.concatenate((np.column_stack((a, ab, ca)), np.column_stack((ab, b, bc)),
+                               np.column_stack((ca, bc, c)), np.column_stack((ab, bc, ca))))
+
+    def draw(self, nodes_or_mesh):
+        from fem import render
+        render.draw_mesh(self.linear, nodes_or_mesh)
+
+class QuadraticSetup(Setup):
+    '''
+    Setup for a QuadraticMesh. The boundary conditions and solvers are
+    those of Setup, except multigrid (no grid). Probing and the field
+    evaluate the quadratic polynomials of the elements
+    '''
+    def init_system_mat(self, is_axisym, sparse=True, matrix_free=False):
+        if matrix_free:
+            raise ValueError("Quadratic elements need an assembled system matrix")
+        util.tic('assemble')
+        num_nodes = len(self.mesh.coords)
+        conn = self.mesh.elems
+        k = element_mats_p2(self.mesh.coords, conn, is_axisym)
+        rows = np.repeat(conn, 6, axis=1).ravel()
+        cols = np.tile(conn, (1, 6)).ravel()
+        if sparse:
+            self.sys = sp.coo_matrix((k.ravel(), (rows, cols)),
+                                     shape=(num_nodes, num_nodes)).tocsr()
+            nbytes = self.sys.data.nbytes + self.sys.indices.nbytes + self.sys.indptr.nbytes
+        else:
+            self.sys = np.zeros((num_nodes, num_nodes))
+            np.add.at(self.sys, (rows, cols), k.ravel())
+            nbytes = self.sys.nbytes
+        util.toc("Created the quadratic system matrix: %0.2f s", nodes=num_nodes,
+                 elements=len(conn), nnz=self.sys.nnz if sparse else np.count_nonzero(self.sys))
+        util.log("System matrix memory:", nbytes, "bytes")
+        util.log("Shape of the matrix:", self.sys.shape)
+
+    def points_in_elems(self, x, y, elem):
+        '''
+        Barycentric coordinates (k, 3) of the points in the elements elem
+        '''
+        coords = self.mesh.coords
+        conn = self.mesh.elems[elem]
+        p0x, p0y = coords[conn[:, 0], 0], coords[conn[:, 0], 1]
+        p1x, p1y = coords[conn[:, 1], 0], coords[conn[:, 1], 1]
+        p2x, p2y = coords[conn[:, 2], 0], coords[conn[:, 2], 1]
+        area2 = -p1y*p2x + p0y*(-p1x + p2x) + p0x*(p1y - p2y) + p1x*p2y
+        s = (p0y*p2x - p0x*p2y + (p2y - p0y)*x + (p0x - p2x)*y)/area2
+        t = (p0x*p1y - p0y*p1x + (p0y - p1y)*x + (p1x - p0x)*y)/area2
+        return np.column_stack((1-s-t, s, t))
+
+    def probe_many(self, xs, ys, chunk=1048576):
+        '''
+        Potentials at the points (xs, ys), as Setup.probe_many but
+        with the quadratic shape functions
+        '''
+        util.tic('probe')
+        xs, ys = np.broadcast_arrays(np.asarray(xs, dtype=float), np.asarray(ys, dtype=float))
+        shape = xs.shape
+        xs = xs.ravel()
+        ys = ys.ravel()
+        out = np.zeros(len(xs))
+        for start in range(0, len(xs), chunk):
+            x = xs[start:start+chunk]
+            y = ys[start:start+chunk]
+            on_el, u = self.mesh.geometry.electrode_mask(x, y)
+            elem = self.mesh.locate(x, y)
+            found = ~on_el & (elem >= 0)
+            L = self.points_in_elems(x[found], y[found], elem[found])
+            u[found] = (shape_values(L)*self.u[self.mesh.elems[elem[found]]]).sum(axis=1)
+            out[start:start+chunk] = u
+        util.toc(None, points=len(xs))
+        return out.reshape(shape)
+
+    def gradients(self, elem, L):
+        '''
+        Gradient of u (k, 2) in the elements elem at barycentric coordinates L
+        '''
+        conn = self.mesh.elems[elem]
+        grad_L = barycentric_gradients(self.mesh.coords, conn[:, :3])[0]
+        G = shape_gradients(L, grad_L)
+        return (G*self.u[conn][:, :, None]).sum(axis=1)
+
+    def lin_coefs(self):
+        '''
+        Linear coefficients of the potential at the vertices (the quadratic
+        terms dropped), as Setup.lin_coefs
+        '''
+        if getattr(self, 'alpha', None) is None:
+            vertices = Setup(self.mesh.linear)
+            vertices.u = self.u[:len(self.mesh.linear.coords)]
+            self.alpha = vertices.lin_coefs()
+        return self.alpha
+
+    def nodal_gradients(self):
+        '''
+        Gradient of u at the nodes, (n,2): the area weighted average of the
+        gradients at the node of the elements around it (vertices and
+        middles of the edges)
+        '''
+        num_nodes = len(self.mesh.coords)
+        conn = self.mesh.elems
+        grad_L, S = barycentric_gradients(self.mesh.coords, conn[:, :3])
+        area = np.abs(S)
+        u = self.u[conn][:, :, None]
+        weight = np.bincount(conn.ravel(), np.repeat(area, 6), minlength=num_nodes)
+        weight[weight == 0] = 1
+        grad = np.zeros((num_nodes, 2))
+        for i, L in enumerate(NODE_POINTS):
+            g = (shape_gradients(L, grad_L)*u).sum(axis=1)
+            for k in range(2):
+                grad[:, k] += np.bincount(conn[:, i], area*g[:, k], minlength=num_nodes)
+        return grad/weight[:, None]
+
+    def field(self):
+        '''
+        Electric field E = -grad(u) at the centroids of the elements, (m,2)
+        '''
+        elems = np.arange(len(self.mesh.elems))
+        return -self.gradients(elems, np.full(3, 1/3))
+
+    def field_magnitude(self):
+        return np.hypot(*self.field().T)
+
+    def field_at(self, xs, ys, chunk=1048576):
+        '''
+        Electric field at the points (xs, ys), shape (..., 2), zero inside
+        electrodes and outside the mesh
+        '''
+        util.tic('probe')
+        xs, ys = np.broadcast_arrays(np.asarray(xs, dtype=float), np.asarray(ys, dtype=float))
+        shape = xs.shape
+        xs = xs.ravel()
+        ys = ys.ravel()
+        out = np.zeros((len(xs), 2))
+        for start in range(0, len(xs), chunk):
+            x = xs[start:start+chunk]
+            y = ys[start:start+chunk]
+            on_el = self.mesh.geometry.electrode_mask(x, y)[0]
+            elem = self.mesh.locate(x, y)
+            found = ~on_el & (elem >= 0)
+            L = self.points_in_elems(x[found], y[found], elem[found])
+            block = out[start:start+chunk]
+            block[found] = -self.gradients(elem[found], L)
+        util.toc(None, points=len(xs))
+        return out.reshape(shape+(2,))
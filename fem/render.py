@@ -0,0 +1,157 @@
+'''
+Plotting of the geometry, mesh and solution with matplotlib
+
+The numerical modules don't import this module (or matplotlib) at load
+time, their draw methods import it when called
+
+Meshes and solutions are drawn as one artist each. When a mesh has
+more edges, nodes or elements than the axes have pixels, it is decimated
+to the resolution of the axes at the time of drawing: edges and nodes are
+snapped to pixels and one is drawn per pixel (pair), the solution is
+sampled on a grid of about one point per pixel
+'''
+import numpy as np
+import matplotlib.patches as pth
+import matplotlib.pyplot as plt
+from matplotlib.tri import Triangulation
+import fem.util as util
+from fem.geometry import CircularElectrode
+
+def electrode_image(el):
+    if isinstance(el, CircularElectrode):
+        return pth.Circle((el.x,el.y),el.r,color='0.75', zorder=1)
+    w = el.x2-el.x1
+    h = el.y2-el.y1
+    return pth.Rectangle((el.x1, el.y1), w, h, angle=0.0, color='0.75', zorder=1)
+
+def set_limits(geometry):
+    axes = plt.gca()
+    axes.set_xlim([geometry.x_min, geometry.x_max])
+    axes.set_ylim([geometry.y_min, geometry.y_max])
+
+def show():
+    plt.show()
+
+def draw_geometry(geometry):
+    axes = plt.gca()
+    for el in geometry.electrodes:
+        axes.add_patch(electrode_image(el))
+    set_limits(geometry)
+
+def draw_element(elem):
+    x = [elem.a.x,elem.b.x,elem.c.x,elem.a.x]
+    y = [elem.a.y,elem.b.y,elem.c.y, elem.a.y]
+    plt.plot(x, y, 'b')
+
+def axes_pixels(axes=None):
+    '''
+    Size of the axes on the screen, (width, height) in pixels
+    '''
+    box = (axes or plt.gca()).get_window_extent()
+    return max(int(box.width), 1), max(int(box.height), 1)
+
+def pixel_keys(points, size):
+    '''
+    Number of the pixel of every point (k, 2) when the bounding box
+    of the points is drawn at size (width, height)
+    '''
+    lo = points.min(axis=0)
+    extent = np.maximum(points.max(axis=0)-lo, 1e-300)
+    w, h = size
+    i = np.minimum((points[:, 0]-lo[0])/extent[0]*w, w-1).astype(np.int64)
+    j = np.minimum((points[:, 1]-lo[1])/extent[1]*h, h-1).astype(np.int64)
+    return i*h+j
+
+def mesh_points(coords, size):
+    '''
+    The nodes, decimated to one per pixel when there are more than pixels
+    '''
+    if len(coords) <= size[0]*size[1]:
+        return coords
+    first = np.unique(pixel_keys(coords, size), return_index=True)[1]
+    return coords[first]
+
+def mesh_segments(mesh, size):
+    '''
+    The edges of the mesh as segments (k, 2, 2). With more elements than
+    pixels, edges inside one pixel are dropped and one edge is kept per
+    pair of pixels
+    '''
+    from fem.adapt import LOCAL_EDGES, edge_table
+    pixels = size[0]*size[1]
+    if len(mesh.elems) <= pixels:
+        return mesh.coords[edge_table(mesh.elems)[0]]
+    edges = mesh.elems[:, LOCAL_EDGES].reshape(-1, 2)
+    keys = pixel_keys(mesh.coords, size)
+    a = keys[edges[:, 0]]
+    b = keys[edges[:, 1]]
+    keep = np.flatnonzero(a != b)
+    pair = np.minimum(a, b)[keep]*pixels+np.maximum(a, b)[keep]
+    return mesh.coords[edges[keep[np.unique(pair, return_index=True)[1]]]]
+
+def draw_mesh(mesh, nodes_or_mesh):
+    '''
+    The nodes (nodes_or_mesh true) or the edges of the mesh, the edges
+    are a single line broken by NaNs
+    '''
+    util.tic('draw')
+    axes = plt.gca()
+    size = axes_pixels(axes)
+    if nodes_or_mesh:
+        points = mesh_points(mesh.coords, size)
+        axes.scatter(points[:, 0], points[:, 1], 3, zorder=2)
+    else:
+        segments = mesh_segments(mesh, size)
+        xy = np.full((len(segments), 3, 2), np.nan)
+        xy[:, :2] = segments
+        axes.plot(xy[..., 0].ravel(), xy[..., 1].ravel(), 'b', linewidth=0.5, zorder=2)
+    util.toc("Drawing mesh: %.2f s")
+
+def draw_solution_old(setup):
+    util.tic('draw')
+    plt.scatter(setup.mesh.coords[:, 0], setup.mesh.coords[:, 1], setup.u, zorder=3)
+    util.toc("Drawing solution: %.2f s")
+
+def grid_values(setup, x_stride=1, y_stride=1):
+    '''
+    The solution on every x_stride-th and y_stride-th grid line of a Mesh,
+    grid points without a node (inside electrodes) get the electrode
+    potential. Returns the lines and the values (ny, nx) for contourf
+    '''
+    mesh = setup.mesh
+    grid = mesh.grid[::x_stride, ::y_stride]
+    x = mesh.x_lines[::x_stride]
+    y = mesh.y_lines[::y_stride]
+    z = np.empty(grid.shape)
+    node = grid >= 0
+    z[node] = setup.u[grid[node]]
+    xs, ys = np.meshgrid(x, y, indexing='ij')
+    z[~node] = mesh.geometry.electrode_mask(xs[~node], ys[~node])[1]
+    return x, y, z.T
+
+def draw_solution(setup, levels=30):
+    '''
+    Filled contours of the solution: on the grid of a Mesh (every n-th
+    line when there are more lines than pixels), on the triangles of other
+    meshes, or sampled at the pixels when there are more triangles
+    '''
+    util.tic('draw')
+    mesh = setup.mesh
+    w, h = axes_pixels()
+    if hasattr(mesh, 'grid'):
+        x, y, z = grid_values(setup, -(-mesh.num_nodes_x//w), -(-mesh.num_nodes_y//h))
+        plt.contourf(x, y, z, levels, zorder=0)
+    else:
+        # TriMesh or QuadraticMesh
+        elems = mesh.split_elems() if hasattr(mesh, 'split_elems') else mesh.elems
+        if len(elems) <= w*h:
+            triangulation = Triangulation(mesh.coords[:, 0], mesh.coords[:, 1], elems)
+            plt.tricontourf(triangulation, setup.u, levels, zorder=0)
+        else:
+            lo = mesh.coords.min(axis=0)
+            hi = mesh.coords.max(axis=0)
+            x = np.linspace(lo[0], hi[0], w)
+            y = np.linspace(lo[1], hi[1], h)
+            plt.contourf(x, y, setup.probe_many(x[None, :], y[:, None]), levels, zorder=0)
+    plt.colorbar()
+    util.toc("Drawing solution: %.2f s")
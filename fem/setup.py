@@ -4,8 +4,103 @@ Created on 18 Jan 2015
 @author: Kristjan
 '''
 import numpy as np
+import scipy.sparse as sp
 import fem.util as util
-import matplotlib.pyplot as plt
+# the solver modules (scipy.sparse.linalg, fem.skyline, fem.pcg,
+# fem.multigrid) are imported by the methods using them, so importing
+# fem.setup stays cheap
+
+def element_coefs(coords, conn):
+    '''
+    Geometric coefficients b, c (n_elem, 3) and areas S (n_elem,)
+    of all elements, book p. 104
+    '''
+    x = coords[conn, 0]
+    y = coords[conn, 1]
+    b = np.empty(x.shape)
+    c = np.empty(x.shape)
+    for i, j, m in ((0, 1, 2), (1, 2, 0), (2, 0, 1)):
+        np.subtract(y[:, j], y[:, m], out=b[:, i])
+        np.subtract(x[:, m], x[:, j], out=c[:, i])
+    S = 0.5*(b[:, 0]*c[:, 1]-b[:, 1]*c[:, 0])
+    return b, c, S
+
+def element_mats(coords, conn, beta=1):
+    '''
+    Stiffness matrices of all elements as a (n_elem, 3, 3) stack,
+    vectorized version of Setup.element_mat
+    Returns the stack, element areas and centroid radii r0
+    '''
+    b, c, S = element_coefs(coords, conn)
+    K = b[:, :, None]*b[:, None, :] + c[:, :, None]*c[:, None, :]
+    K *= (beta/(4*S))[:, None, None]
+    r0 = coords[conn, 0].mean(axis=1)
+    return K, S, r0
+
+def element_mats_axisym(coords, conn, beta=1):
+    '''
+    Vectorized version of Setup.element_mat_axisym, book p. 160
+    Returns the stack, element areas and centroid radii r0
+    '''
+    K, S, r0 = element_mats(coords, conn, beta)
+    K *= (2*np.pi*r0)[:, None, None]
+    return K, S, r0
+
+class ElementOperator(object):
+    '''
+    The system matrix applied element by element, without assembling it.
+    The element matrices are recomputed for chunks of elements on every
+    product, so the memory use is bounded by the chunk size.
+    With free set, the operator acts on the free nodes only
+    '''
+    def __init__(self, coords, conn, is_axisym, free=None, chunk=262144):
+        self.coords = coords
+        self.conn = conn
+        self.is_axisym = is_axisym
+        self.free = free
+        self.chunk = chunk
+        n = len(coords) if free is None else len(free)
+        self.shape = (n, n)
+    
+    def restrict(self, free):
+        return ElementOperator(self.coords, self.conn, self.is_axisym, free, self.chunk)
+    
+    def element_coefs(self, conn):
+        '''
+        b, c and the factor f of the element matrices K = f*(b*b^T+c*c^T)
+        '''
+        b, c, S = element_coefs(self.coords, conn)
+        f = 1/(4*S)
+        if self.is_axisym:
+            f *= 2*np.pi*self.coords[conn, 0].mean(axis=1)
+        return b, c, f
+    
+    def dot(self, x):
+        num_nodes = len(self.coords)
+        if self.free is not None:
+            x_full = np.zeros(num_nodes)
+            x_full[self.free] = x
+            x = x_full
+        y = np.zeros(num_nodes)
+        for start in range(0, len(self.conn), self.chunk):
+            conn = self.conn[start:start+self.chunk]
+            b, c, f = self.element_coefs(conn)
+            x_el = x[conn]
+            bx = f*(b*x_el).sum(axis=1)
+            cx = f*(c*x_el).sum(axis=1)
+            y_el = b*bx[:, None] + c*cx[:, None]
+            y += np.bincount(conn.ravel(), y_el.ravel(), minlength=num_nodes)
+        return y if self.free is None else y[self.free]
+    
+    def diagonal(self):
+        num_nodes = len(self.coords)
+        d = np.zeros(num_nodes)
+        for start in range(0, len(self.conn), self.chunk):
+            conn = self.conn[start:start+self.chunk]
+            b, c, f = self.element_coefs(conn)
+            d += np.bincount(conn.ravel(), (f[:, None]*(b*b + c*c)).ravel(),
+                             minlength=num_nodes)
+        return d if self.free is None else d[self.free]
 
 class Setup(object):
     '''
@@ -57,53 +152,205 @@ class Setup(object):
         return K
         
     
-    def init_system_mat(self, is_axisym):
-        util.tic()
-        num_nodes = len(self.mesh.nodes)
-        self.sys = np.zeros((num_nodes, num_nodes)) # SYSTEM MATRIX
-        for el in self.mesh.elements:
-            if is_axisym:
-                k = self.element_mat_axisym(el)
-            else:
-                k = self.element_mat(el)
-            for i in range(len(el.nodes)):
-                for j in range(len(el.nodes)):
-                    nr1 = el.nodes[i].nr
-                    nr2 = el.nodes[j].nr
-                    self.sys[nr1, nr2] = self.sys[nr1, nr2] + k[i,j]
-        util.toc("Created the system matrix: %0.2f s")
-        print("System matrix memory:", self.sys.nbytes, "bytes")
-        print("Shape of the matrix:", self.sys.shape)
+    def init_system_mat(self, is_axisym, sparse=False, matrix_free=False):
+        '''
+        Assembles the global system matrix.
+        The element matrices are scattered as COO triplets (row, col, value)
+        in one batch; with sparse=True the result is stored as a CSR matrix.
+        With matrix_free=True nothing is assembled, self.sys is an
+        ElementOperator instead (for the PCG solver)
+        '''
+        util.tic('assemble')
+        num_nodes = len(self.mesh.coords)
+        coords = self.mesh.coords
+        conn = self.mesh.elems
+        if matrix_free:
+            self.sys = ElementOperator(coords, conn, is_axisym)
+            self.area = element_coefs(coords, conn)[2]
+            self.r0 = coords[conn, 0].mean(axis=1)
+            util.toc("Created the matrix-free operator: %0.2f s", nodes=num_nodes, elements=len(conn))
+            util.log("System matrix memory: 0 bytes (matrix-free)")
+            return
+        if is_axisym:
+            k, self.area, self.r0 = element_mats_axisym(coords, conn)
+        else:
+            k, self.area, self.r0 = element_mats(coords, conn)
+        rows = np.repeat(conn, 3, axis=1).ravel()
+        cols = np.tile(conn, (1, 3)).ravel()
+        if sparse:
+            # duplicate triplets are summed in the conversion
+            self.sys = sp.coo_matrix((k.ravel(), (rows, cols)),
+                                     shape=(num_nodes, num_nodes)).tocsr()
+            nbytes = self.sys.data.nbytes + self.sys.indices.nbytes + self.sys.indptr.nbytes
+        else:
+            self.sys = np.zeros((num_nodes, num_nodes)) # SYSTEM MATRIX
+            np.add.at(self.sys, (rows, cols), k.ravel())
+            nbytes = self.sys.nbytes
+        nnz = self.sys.nnz if sparse else np.count_nonzero(self.sys)
+        util.toc("Created the system matrix: %0.2f s", nodes=num_nodes, elements=len(conn), nnz=nnz)
+        util.log("System matrix memory:", nbytes, "bytes")
+        util.log("Shape of the matrix:", self.sys.shape)
     
     def boundary_conditions(self):
         '''
         Incorporates the boundary conditions into the matrix equation.
-        Currently uses loops, but efficient numpy matrix operations could also be used
-        '''
-        util.tic()
-        self.b = np.zeros(len(self.mesh.nodes)) # RHS of the matrix eq
-        for node in self.mesh.nodes:
-            if node.on_el:
-                for i in range(len(self.mesh.nodes)):
-                    if not self.mesh.nodes[i].on_el:
-                        # T.PLANK'S SOL DIDN'T DO THIS!
-                        self.b[i] = self.b[i]-self.sys[i, node.nr]*node.u
-                        #print(self.sys[i, node.nr]*node.u)
-                    self.sys[i, node.nr] = 0
-                    self.sys[node.nr, i] = 0
-                self.b[node.nr] = node.u
-                self.sys[node.nr, node.nr] = 1
-        util.toc("Processed boundary conditions: %0.2f s")
+        The nodes are split into free ones and fixed ones (on electrodes),
+        the equation to solve is reduced to
+        sys_ff*u_f = b_f = -sys_fc*u_c
+        self.sys itself is left unchanged
+        '''
+        util.tic('boundary')
+        self.factor = None
+        on_el = self.mesh.on_el
+        self.free = np.flatnonzero(~on_el)
+        self.fixed = np.flatnonzero(on_el)
+        self.u_c = self.mesh.u_el[self.fixed]
+        if isinstance(self.sys, ElementOperator):
+            self.sys_ff = self.sys.restrict(self.free)
+            u = np.zeros(len(on_el))
+            u[self.fixed] = self.u_c
+            self.b_f = -self.sys.dot(u)[self.free]
+            util.toc("Processed boundary conditions: %0.2f s", free=len(self.free))
+            return
+        if sp.issparse(self.sys):
+            rows = self.sys.tocsr()[self.free]
+            self.sys_ff = rows[:, self.free].tocsr()
+            sys_fc = rows[:, self.fixed]
+        else:
+            self.sys_ff = self.sys[np.ix_(self.free, self.free)]
+            sys_fc = self.sys[np.ix_(self.free, self.fixed)]
+        self.b_f = -sys_fc.dot(self.u_c) # RHS of the matrix eq
+        util.toc("Processed boundary conditions: %0.2f s", free=len(self.free))
+    
+    def full_solution(self, u_f):
+        '''
+        Potentials of all nodes from the solution for the free nodes
+        '''
+        u = np.empty(len(self.mesh.on_el))
+        u[self.free] = u_f
+        u[self.fixed] = self.u_c
+        return u
         
-    def solve(self, method):
-        util.tic()
+    def solve(self, method, reorder=True, precond='jacobi', tol=1e-8, maxiter=None, x0=None):
+        '''
+        method: 0 - numpy inverse matrix, 1 - gaussian elimination,
+        2 - Cholesky decomposition in skyline storage, 3 - sparse LU,
+        4 - preconditioned conjugate gradients, 5 - geometric multigrid
+        (preconditioning conjugate gradients on a graded grid)
+        reorder: renumber the unknowns by reverse Cuthill-McKee for method 2
+        precond: preconditioner of method 4: 'jacobi', 'ic0', 'mg' or None
+        tol, maxiter: options of methods 4 and 5,
+        the residual history is kept in self.residuals
+        x0: initial guess for the free nodes of methods 4 and 5
+        '''
+        util.tic('solve')
         if method==1:
-            print("Gaussian elimination")
-            self.u = self.gaussian_el(self.sys, self.b)
+            util.log("Gaussian elimination")
+            u_f = self.gaussian_el(self.sys_ff, self.b_f)
+        elif method==2:
+            util.log("Cholesky decomposition, skyline storage")
+            u_f = self.skyline_solve(reorder)
+        elif method==3:
+            util.log("Sparse LU decomposition")
+            import scipy.sparse.linalg as spla
+            u_f = spla.spsolve(self.sys_ff.tocsc(), self.b_f)
+        elif method==4:
+            util.log("Preconditioned conjugate gradients, preconditioner:", precond)
+            u_f = self.pcg_solve(precond, tol, maxiter, x0)
+        elif method==5:
+            util.log("Geometric multigrid")
+            u_f = self.multigrid_solve(tol, maxiter, x0)
         else:
-            print("Numpy inverse matrix")
-            self.u = np.linalg.inv(self.sys).dot(self.b)
-        util.toc("Solved the equation: %0.2f s")
+            util.log("Numpy inverse matrix")
+            u_f = np.linalg.inv(self.sys_ff).dot(self.b_f)
+        self.u = self.full_solution(u_f)
+        self.alpha = None
+        util.toc("Solved the equation: %0.2f s", unknowns=len(self.b_f))
+    
+    def preconditioner(self, precond):
+        import fem.pcg as pcg
+        if precond is None:
+            return None
+        if precond == 'jacobi':
+            if isinstance(self.sys_ff, ElementOperator):
+                return pcg.Jacobi(self.sys_ff.diagonal())
+            return pcg.Jacobi(sp.csr_matrix(self.sys_ff).diagonal())
+        if precond == 'ic0':
+            if isinstance(self.sys_ff, ElementOperator):
+                raise ValueError("IC(0) needs an assembled system matrix")
+            if not isinstance(self.factor, pcg.IncompleteCholesky):
+                self.factor = pcg.IncompleteCholesky(self.sys_ff)
+            return self.factor
+        if precond == 'mg':
+            return self.multigrid()
+        raise ValueError("Unknown preconditioner: %s" % precond)
+    
+    def pcg_solve(self, precond, tol, maxiter, x0=None):
+        import fem.pcg as pcg
+        m = self.preconditioner(precond)
+        u_f, self.residuals = pcg.pcg(self.sys_ff, self.b_f, m, x0, tol, maxiter)
+        util.count(iterations=len(self.residuals)-1)
+        util.log("Iterations: %d, relative residual: %.2e" %
+              (len(self.residuals)-1, self.residuals[-1]))
+        return u_f
+    
+    def multigrid(self):
+        '''
+        The multigrid hierarchy of the system, kept in self.factor
+        '''
+        import fem.multigrid as multigrid
+        if isinstance(self.sys_ff, ElementOperator):
+            raise ValueError("Multigrid needs an assembled system matrix")
+        if not hasattr(self.mesh, 'grid'):
+            raise ValueError("Multigrid needs the structured grid of Mesh")
+        if not isinstance(self.factor, multigrid.Multigrid):
+            self.factor = multigrid.Multigrid(self.mesh, self.sys_ff, self.free)
+        return self.factor
+    
+    def multigrid_solve(self, tol, maxiter, x0=None):
+        '''
+        V-cycles until the relative residual is below tol. On a graded grid
+        the V-cycles alone stall, they precondition conjugate gradients.
+        Raises ValueError when tol isn't reached in maxiter iterations
+        '''
+        if getattr(self.mesh, 'x_step', None) is None or self.mesh.y_step is None:
+            util.log("Graded grid, conjugate gradients preconditioned by multigrid")
+            u_f = self.pcg_solve('mg', tol, maxiter, x0)
+        else:
+            mg = self.multigrid()
+            u_f, self.residuals = mg.iterate(self.b_f, x0, tol, maxiter or 100)
+            util.count(iterations=len(self.residuals)-1)
+            util.log("V-cycles: %d, relative residual: %.2e" %
+                  (len(self.residuals)-1, self.residuals[-1]))
+        if self.residuals[-1] >= tol:
+            raise ValueError("Multigrid did not converge: relative residual %.2e after %d iterations"
+                             % (self.residuals[-1], len(self.residuals)-1))
+        return u_f
+    
+    def skyline_solve(self, reorder):
+        '''
+        The decomposition is kept in self.factor (and the ordering in
+        self.perm), solving again with another b_f reuses it
+        '''
+        import fem.skyline as skyline
+        if isinstance(self.factor, skyline.SkylineMatrix):
+            perm = self.perm
+            sky = self.factor
+        else:
+            if reorder:
+                perm = skyline.rcm_order(self.sys_ff)
+            else:
+                perm = np.arange(len(self.b_f))
+            sys_ff = sp.csr_matrix(self.sys_ff)[perm][:, perm]
+            sky = skyline.SkylineMatrix(sys_ff)
+            util.log("Profile size:", sky.profile(), "entries,", sky.values.nbytes, "bytes")
+            util.log("Bandwidth: %d, fill: %.2f (profile/nonzeros)" %
+                  (sky.bandwidth(), sky.profile()/max(sky.nnz, 1)))
+            self.factor = sky
+            self.perm = perm
+        u_f = np.empty(len(perm))
+        u_f[perm] = sky.solve(self.b_f[perm])
+        return u_f
     
     def gaussian_el(self, in_sys, in_b):
         '''
@@ -117,7 +364,8 @@ class Setup(object):
         eps = 1e-10
         for j in range(n_cols):
             if j%100==0:
-                print("%.2f%%" % (j/n_cols*100))
+                util.log("%.2f%%" % (j/n_cols*100))
+            util.progress(j, n_cols)
             for i in range(j+1,n_rows):
                 if sys[i,j] > eps or sys[i,j] < -eps:
                     k = sys[i,j]/sys[j,j]
@@ -135,48 +383,122 @@ class Setup(object):
         return u
     
     def probe_u(self, x, y):
-        a = self.mesh.geometry.is_electrode(x,y)
-        if a[0]:
-            return a[1]
-        for el in self.mesh.elements:
-            if el.in_elem(x, y):
-                alp = el.lin_coef(self.u)
-                return alp[0]+alp[1]*x+alp[2]*y
-        return 0
+        return float(self.probe_many(x, y))
+    
+    def probe_many(self, xs, ys, chunk=1048576):
+        '''
+        Potentials at the points (xs, ys), arrays of any (broadcastable) shape.
+        Points on electrodes get the electrode potential, the others are
+        interpolated linearly in the element found by Mesh.locate.
+        Points outside the mesh get 0. Evaluated in chunks of points
+        to bound the memory use
+        '''
+        util.tic('probe')
+        xs, ys = np.broadcast_arrays(np.asarray(xs, dtype=float), np.asarray(ys, dtype=float))
+        shape = xs.shape
+        xs = xs.ravel()
+        ys = ys.ravel()
+        out = np.zeros(len(xs))
+        coords = self.mesh.coords
+        for start in range(0, len(xs), chunk):
+            x = xs[start:start+chunk]
+            y = ys[start:start+chunk]
+            on_el, u = self.mesh.geometry.electrode_mask(x, y)
+            elem = self.mesh.locate(x, y)
+            found = ~on_el & (elem >= 0)
+            conn = self.mesh.elems[elem[found]]
+            # barycentric coordinates, same formulas as Element.in_elem
+            p0x, p0y = coords[conn[:, 0], 0], coords[conn[:, 0], 1]
+            p1x, p1y = coords[conn[:, 1], 0], coords[conn[:, 1], 1]
+            p2x, p2y = coords[conn[:, 2], 0], coords[conn[:, 2], 1]
+            xf = x[found]
+            yf = y[found]
+            area2 = -p1y*p2x + p0y*(-p1x + p2x) + p0x*(p1y - p2y) + p1x*p2y
+            s = (p0y*p2x - p0x*p2y + (p2y - p0y)*xf + (p0x - p2x)*yf)/area2
+            t = (p0x*p1y - p0y*p1x + (p0y - p1y)*xf + (p1x - p0x)*yf)/area2
+            uf = self.u[conn]
+            u[found] = (1-s-t)*uf[:, 0] + s*uf[:, 1] + t*uf[:, 2]
+            out[start:start+chunk] = u
+        util.toc(None, points=len(xs))
+        return out.reshape(shape)
+    
+    
+    def lin_coefs(self):
+        '''
+        Linear coefficients of the potential in all elements as a (m,3) array,
+        u(x,y)=alpha1+alpha2*x+alpha3*y as in Element.lin_coef.
+        Computed once per solution, book p. 104:
+        alpha = [a, b, c]*u_nodes/(2*S), a_i = x_j*y_m - x_m*y_j
+        '''
+        if getattr(self, 'alpha', None) is None:
+            coords = self.mesh.coords
+            conn = self.mesh.elems
+            b, c, S = element_coefs(coords, conn)
+            x = coords[conn, 0]
+            y = coords[conn, 1]
+            a = np.empty(x.shape)
+            for i, j, m in ((0, 1, 2), (1, 2, 0), (2, 0, 1)):
+                a[:, i] = x[:, j]*y[:, m] - x[:, m]*y[:, j]
+            u = self.u[conn]
+            self.alpha = np.column_stack(((a*u).sum(axis=1), (b*u).sum(axis=1),
+                                          (c*u).sum(axis=1)))/(2*S)[:, None]
+        return self.alpha
     
+    def field(self):
+        '''
+        Electric field E = -grad(u) of all elements, (m,2)
+        '''
+        return -self.lin_coefs()[:, 1:]
+    
+    def field_magnitude(self):
+        alpha = self.lin_coefs()
+        return np.hypot(alpha[:, 1], alpha[:, 2])
+    
+    def nodal_gradients(self):
+        '''
+        Gradient of u at the nodes, (n,2): the area weighted average of the
+        constant gradients of the elements around the node
+        '''
+        num_nodes = len(self.mesh.coords)
+        conn = self.mesh.elems.ravel()
+        alpha = self.lin_coefs()
+        area = np.repeat(np.abs(element_coefs(self.mesh.coords, self.mesh.elems)[2]), 3)
+        weight = np.bincount(conn, area, minlength=num_nodes)
+        weight[weight == 0] = 1
+        grad = np.empty((num_nodes, 2))
+        for k in range(2):
+            grad[:, k] = np.bincount(conn, area*np.repeat(alpha[:, k+1], 3),
+                                     minlength=num_nodes)/weight
+        return grad
+    
+    def field_at(self, xs, ys, chunk=1048576):
+        '''
+        Electric field at the points (xs, ys), shape (..., 2).
+        The field is constant in an element, zero inside electrodes
+        and outside the mesh
+        '''
+        util.tic('probe')
+        xs, ys = np.broadcast_arrays(np.asarray(xs, dtype=float), np.asarray(ys, dtype=float))
+        shape = xs.shape
+        xs = xs.ravel()
+        ys = ys.ravel()
+        e = self.field()
+        out = np.zeros((len(xs), 2))
+        for start in range(0, len(xs), chunk):
+            x = xs[start:start+chunk]
+            y = ys[start:start+chunk]
+            on_el = self.mesh.geometry.electrode_mask(x, y)[0]
+            elem = self.mesh.locate(x, y)
+            found = ~on_el & (elem >= 0)
+            block = out[start:start+chunk]
+            block[found] = e[elem[found]]
+        util.toc(None, points=len(xs))
+        return out.reshape(shape+(2,))
     
     def draw_old(self):
-        util.tic()
-        x=[]
-        y=[]
-        z=[]
-        for node in self.mesh.nodes:
-            x.append(node.x)
-            y.append(node.y)
-            z.append(self.u[node.nr])
-        plt.scatter(x, y, z, zorder=3)
-        util.toc("Drawing solution: %.2f s")
+        from fem import render
+        render.draw_solution_old(self)
     
     def draw(self):
-        util.tic()
-        x=[]
-        y=[]
-        z=np.zeros((self.mesh.num_nodes_x, self.mesh.num_nodes_y))
-        for i in range(self.mesh.num_nodes_x):
-            for j in range(self.mesh.num_nodes_y):
-                if self.mesh.grid[i, j] != -1:
-                    z[j,i] = self.u[self.mesh.grid[i,j]]
-                else:
-                    xp = i*self.mesh.x_step+self.mesh.geometry.x_min
-                    yp = j*self.mesh.y_step+self.mesh.geometry.y_min
-                    z[j,i] = self.mesh.geometry.is_electrode(xp,yp)[1]
-        for i in range(self.mesh.num_nodes_x):
-            xp = i*self.mesh.x_step+self.mesh.geometry.x_min
-            x.append(xp)
-        for j in range(self.mesh.num_nodes_y):
-            yp = j*self.mesh.y_step+self.mesh.geometry.y_min
-            y.append(yp)
-        plt.contourf(x, y, z, 30, zorder=0)
-        plt.colorbar()
-        util.toc("Drawing solution: %.2f s")
-        
\ No newline at end of file
+        from fem import render
+        render.draw_solution(self)
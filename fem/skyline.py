@@ -0,0 +1,136 @@
+'''
+Skyline (profile) storage for symmetric positive definite matrices
+and the Cholesky decomposition on it
+'''
+import numpy as np
+import scipy.sparse as sp
+import scipy.linalg as sla
+from scipy.sparse.csgraph import reverse_cuthill_mckee
+import fem.util as util
+
+def rcm_order(mat):
+    '''
+    Reverse Cuthill-McKee ordering of the unknowns, reduces the profile
+    '''
+    return reverse_cuthill_mckee(sp.csr_matrix(mat), symmetric_mode=True)
+
+class SkylineMatrix(object):
+    '''
+    Upper triangle of a symmetric matrix, stored column by column from the
+    first non-zero row of the column down to the diagonal.
+    Column j is values[ptr[j]:ptr[j+1]], its last entry is the diagonal
+    and its first one is in row first[j].
+    '''
+    def __init__(self, mat):
+        upper = sp.triu(sp.csc_matrix(mat), format='csc')
+        upper.sum_duplicates()
+        self.n = upper.shape[0]
+        self.nnz = upper.nnz
+        self.first = np.arange(self.n)
+        nonempty = np.flatnonzero(np.diff(upper.indptr) > 0)
+        if len(nonempty) > 0:
+            self.first[nonempty] = np.minimum.reduceat(upper.indices,
+                                                       upper.indptr[nonempty])
+        heights = np.arange(self.n)-self.first+1
+        self.ptr = np.zeros(self.n+1, dtype=np.int64)
+        np.cumsum(heights, out=self.ptr[1:])
+        self.values = np.zeros(self.ptr[-1])
+        coo = upper.tocoo()
+        self.values[self.index(coo.row, coo.col)] = coo.data
+        self.factored = False
+
+    @staticmethod
+    def from_arrays(first, ptr, values, nnz, factored=True):
+        '''
+        Skyline matrix from its stored arrays (first, ptr, values)
+        '''
+        sky = SkylineMatrix.__new__(SkylineMatrix)
+        sky.n = len(first)
+        sky.nnz = nnz
+        sky.first = first
+        sky.ptr = ptr
+        sky.values = values
+        sky.factored = factored
+        return sky
+
+    def index(self, rows, cols):
+        '''
+        Position of the entries (rows, cols) in self.values
+        '''
+        return self.ptr[cols+1]-1-(cols-rows)
+
+    def profile(self):
+        '''
+        Number of stored entries
+        '''
+        return int(self.ptr[-1])
+
+    def bandwidth(self):
+        return int((np.arange(self.n)-self.first).max()) if self.n > 0 else 0
+
+    def block(self, r0, r1, c0, c1):
+        '''
+        Dense copy of rows r0..r1-1 and columns c0..c1-1 of the stored triangle,
+        entries outside the profile are zero
+        '''
+        rows = np.arange(r0, r1)[:, None]
+        cols = np.arange(c0, c1)[None, :]
+        inside = (rows >= self.first[cols]) & (rows <= cols)
+        idx = np.where(inside, self.index(rows, cols), 0)
+        return np.where(inside, self.values[idx], 0.0)
+
+    def set_block(self, r0, c0, blk):
+        '''
+        Writes the profile entries of the dense block back
+        '''
+        rows = np.arange(r0, r0+blk.shape[0])[:, None]
+        cols = np.arange(c0, c0+blk.shape[1])[None, :]
+        inside = (rows >= self.first[cols]) & (rows <= cols)
+        self.values[self.index(rows, cols)[inside]] = blk[inside]
+
+    def cholesky(self, block_size=64):
+        '''
+        In-place decomposition A = U^T*U, U takes the place of A.
+        There is no fill outside the profile. The columns are processed
+        in blocks: for the block J of columns starting at row m
+        U[m:J, J] = U[m:J, m:J]^-T * A[m:J, J]
+        U[J, J] = chol(A[J, J] - U[m:J, J]^T * U[m:J, J])
+        '''
+        for j0 in range(0, self.n, block_size):
+            util.progress(j0, self.n)
+            j1 = min(j0+block_size, self.n)
+            m = self.first[j0:j1].min()
+            a = self.block(m, j1, j0, j1)
+            if m < j0:
+                u = self.block(m, j0, m, j0)
+                x = sla.solve_triangular(u, a[:j0-m], trans='T', check_finite=False)
+                a[:j0-m] = x
+                a[j0-m:] -= x.T.dot(x)
+            a[j0-m:] = sla.cholesky(a[j0-m:], lower=False, check_finite=False)
+            self.set_block(m, j0, a)
+        self.factored = True
+
+    def solve(self, b, block_size=64):
+        '''
+        Solves A*x = b with the decomposed matrix:
+        U^T*y = b, then U*x = y
+        '''
+        if not self.factored:
+            self.cholesky(block_size)
+        y = np.array(b, dtype=float)
+        starts = list(range(0, self.n, block_size))
+        for j0 in starts:
+            j1 = min(j0+block_size, self.n)
+            m = self.first[j0:j1].min()
+            if m < j0:
+                y[j0:j1] -= self.block(m, j0, j0, j1).T.dot(y[m:j0])
+            y[j0:j1] = sla.solve_triangular(self.block(j0, j1, j0, j1), y[j0:j1],
+                                            trans='T', check_finite=False)
+        for j0 in reversed(starts):
+            j1 = min(j0+block_size, self.n)
+            m = self.first[j0:j1].min()
+            y[j0:j1] = sla.solve_triangular(self.block(j0, j1, j0, j1), y[j0:j1],
+                                            check_finite=False)
+            if m < j0:
+                y[m:j0] -= self.block(m, j0, j0, j1).dot(y[j0:j1])
+        return y
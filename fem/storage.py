@@ -0,0 +1,171 @@
+'''
+Saving and loading meshes, system matrices and solutions
+
+A saved object is a directory with one .npy file per array and a header
+meta.json: {'format': 'fem', 'version': 1, 'kind': ..., ...}. The header
+is written last, so a directory without it is an incomplete save.
+Loading memory-maps the arrays by default (mmap=True): nothing is read
+until it is used, and probing a solution reads only the pages of the
+elements it touches.
+'''
+import json
+import os
+
+import numpy as np
+import scipy.sparse as sp
+
+from fem.geometry import Geometry
+from fem.mesh import Element, ItemList, Mesh, Node, TriMesh
+
+VERSION = 1
+
+def save_arrays(path, kind, meta, arrays):
+    '''
+    Writes the arrays (a dict of name: array) and the header with
+    the JSON-serializable dict meta into the directory path
+    '''
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    header = os.path.join(path, 'meta.json')
+    if os.path.exists(header):
+        os.remove(header)
+    for name, array in arrays.items():
+        np.save(os.path.join(path, name+'.npy'), np.ascontiguousarray(array))
+    header_dict = {'format': 'fem', 'version': VERSION, 'kind': kind,
+                   'arrays': sorted(arrays)}
+    header_dict.update(meta)
+    with open(header+'.tmp', 'w') as f:
+        json.dump(header_dict, f)
+    os.replace(header+'.tmp', header)
+
+def load_arrays(path, kinds, mmap=True):
+    '''
+    The header and the arrays of a directory written by save_arrays,
+    the kind must be one of kinds
+    '''
+    try:
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+    except FileNotFoundError:
+        raise ValueError("Not a saved fem object (no meta.json): %s" % path)
+    if meta.get('format') != 'fem':
+        raise ValueError("Not a saved fem object: %s" % path)
+    if meta['version'] > VERSION:
+        raise ValueError("Saved with a newer format version %d (supported %d): %s" %
+                         (meta['version'], VERSION, path))
+    if meta['kind'] not in kinds:
+        raise ValueError("Expected %s, found %s: %s" % (' or '.join(kinds), meta['kind'], path))
+    arrays = {}
+    for name in meta['arrays']:
+        arrays[name] = np.load(os.path.join(path, name+'.npy'),
+                               mmap_mode='r' if mmap else None)
+    return meta, arrays
+
+def mesh_arrays(mesh, prefix=''):
+    '''
+    Header entries and arrays of a Mesh or a TriMesh
+    '''
+    meta = {prefix+'mesh': 'grid' if isinstance(mesh, Mesh) else 'triangles',
+            prefix+'geometry': mesh.geometry.to_dict()}
+    arrays = {'coords': mesh.coords, 'elems': mesh.elems, 'el_index': mesh.el_index}
+    if isinstance(mesh, Mesh):
+        meta[prefix+'steps'] = [mesh.x_step, mesh.y_step]
+        arrays.update(grid=mesh.grid, cells=mesh.cells,
+                      x_lines=mesh.x_lines, y_lines=mesh.y_lines)
+    return meta, {prefix+name: a for name, a in arrays.items()}
+
+def make_mesh(meta, arrays, prefix=''):
+    geometry = Geometry.from_dict(meta[prefix+'geometry'])
+    def get(name):
+        return arrays[prefix+name]
+    if meta[prefix+'mesh'] == 'triangles':
+        return TriMesh(geometry, get('coords'), get('elems'), get('el_index'))
+    # not through Mesh.__init__, it would allocate a new grid
+    mesh = Mesh.__new__(Mesh)
+    mesh.geometry = geometry
+    mesh.x_step, mesh.y_step = meta[prefix+'steps']
+    mesh.x_lines = get('x_lines')
+    mesh.y_lines = get('y_lines')
+    mesh.num_nodes_x = len(mesh.x_lines)
+    mesh.num_nodes_y = len(mesh.y_lines)
+    mesh.grid = get('grid')
+    mesh.cells = get('cells')
+    mesh.coords = get('coords')
+    mesh.elems = get('elems')
+    mesh.el_index = get('el_index')
+    mesh.on_el = mesh.el_index >= 0
+    mesh.u_el = np.append(geometry.potentials(), 0.0)[mesh.el_index]
+    mesh.nodes = ItemList(mesh, Node, 'coords')
+    mesh.elements = ItemList(mesh, Element, 'elems')
+    return mesh
+
+def save_mesh(path, mesh):
+    '''
+    Saves a Mesh (arrays, grid, lines and the geometry) or a TriMesh
+    '''
+    meta, arrays = mesh_arrays(mesh)
+    save_arrays(path, 'mesh', meta, arrays)
+
+def load_mesh(path, mmap=True):
+    meta, arrays = load_arrays(path, ['mesh', 'solution'], mmap)
+    return make_mesh(meta, arrays)
+
+def matrix_arrays(mat, prefix=''):
+    mat = sp.csr_matrix(mat)
+    return ({prefix+'shape': list(mat.shape)},
+            {prefix+'data': mat.data, prefix+'indices': mat.indices, prefix+'indptr': mat.indptr})
+
+def make_matrix(meta, arrays, prefix=''):
+    return sp.csr_matrix((arrays[prefix+'data'], arrays[prefix+'indices'],
+                          arrays[prefix+'indptr']), shape=tuple(meta[prefix+'shape']))
+
+def save_matrix(path, mat):
+    '''
+    Saves a sparse or dense matrix in CSR form
+    '''
+    meta, arrays = matrix_arrays(mat)
+    save_arrays(path, 'matrix', meta, arrays)
+
+def load_matrix(path, mmap=True):
+    '''
+    The saved matrix as a scipy CSR matrix
+    '''
+    meta, arrays = load_arrays(path, ['matrix'], mmap)
+    return make_matrix(meta, arrays)
+
+def save_solution(path, setup, with_matrix=False):
+    '''
+    Saves the mesh and the solution setup.u of a Setup (or QuadraticSetup,
+    its linear mesh is saved), and with with_matrix the system matrix
+    '''
+    from fem.quadratic import QuadraticMesh
+    mesh = setup.mesh
+    order = 2 if isinstance(mesh, QuadraticMesh) else 1
+    meta, arrays = mesh_arrays(mesh.linear if order == 2 else mesh)
+    meta['order'] = order
+    arrays['u'] = setup.u
+    if with_matrix:
+        mat_meta, mat_arrays = matrix_arrays(setup.sys, 'sys_')
+        meta.update(mat_meta)
+        arrays.update(mat_arrays)
+    save_arrays(path, 'solution', meta, arrays)
+
+def load_solution(path, mmap=True):
+    '''
+    A Setup (QuadraticSetup for order 2) with the saved mesh and u,
+    and sys if it was saved. It can be probed and drawn, solving
+    again needs init_system_mat and boundary_conditions
+    '''
+    meta, arrays = load_arrays(path, ['solution'], mmap)
+    mesh = make_mesh(meta, arrays)
+    if meta.get('order', 1) == 2:
+        from fem.quadratic import QuadraticMesh, QuadraticSetup
+        setup = QuadraticSetup(QuadraticMesh(mesh))
+    else:
+        from fem.setup import Setup
+        setup = Setup(mesh)
+    setup.u = arrays['u']
+    setup.alpha = None
+    if 'sys_shape' in meta:
+        setup.sys = make_matrix(meta, arrays, 'sys_')
+    return setup
@@ -0,0 +1,66 @@
+'''
+Voltage sweeps on a fixed mesh by superposition
+'''
+import copy
+
+import numpy as np
+import scipy.sparse.linalg as spla
+import fem.util as util
+from fem.mesh import with_potentials
+from fem.setup import Setup
+
+class Sweep(object):
+    '''
+    The system matrix is assembled and factorized once. One basis solution
+    is computed per electrode (1 V on it, 0 V on the others), all of them
+    in one multi-RHS solve. The solution for any electrode voltages V is
+    then u = basis*V, no more solves are needed.
+    '''
+    def __init__(self, mesh, is_axisym):
+        self.mesh = mesh
+        self.is_axisym = is_axisym
+        self.setup = Setup(mesh)
+        self.setup.init_system_mat(is_axisym, sparse=True)
+        self.setup.boundary_conditions()
+        util.tic('sweep')
+        setup = self.setup
+        self.lu = spla.splu(setup.sys_ff.tocsc())
+        num_el = len(mesh.geometry.electrodes)
+        # unit potentials of the fixed nodes, one column per electrode
+        unit = (mesh.el_index[setup.fixed][:, None] == np.arange(num_el)).astype(float)
+        rhs = -setup.sys[setup.free][:, setup.fixed].dot(unit)
+        self.basis = np.empty((len(mesh.coords), num_el))
+        if len(setup.free) > 0 and num_el > 0:
+            self.basis[setup.free] = self.lu.solve(np.asarray(rhs))
+        else:
+            self.basis[setup.free] = 0
+        self.basis[setup.fixed] = unit
+        util.toc("Computed the sweep basis: %0.2f s", solutions=num_el)
+        util.log("Basis solutions:", num_el)
+
+    def solve(self, voltages):
+        '''
+        voltages: (num_el,) electrode potentials or a (batch, num_el) array
+        of voltage sets, solved together as one matrix product
+        Returns the nodal potentials, (n,) or (batch, n)
+        '''
+        voltages = np.asarray(voltages, dtype=float)
+        return voltages.dot(self.basis.T)
+
+    def apply(self, voltages):
+        '''
+        A Setup solved for the voltages, for probing and drawing. Its mesh
+        and geometry are copies with the electrodes at the voltages, the
+        matrices and the factorization are shared with self.setup
+        '''
+        voltages = np.asarray(voltages, dtype=float)
+        geometry = self.mesh.geometry.copy()
+        for el, u in zip(geometry.electrodes, voltages):
+            el.u = float(u)
+        setup = copy.copy(self.setup)
+        setup.mesh = with_potentials(self.mesh, geometry)
+        setup.u_c = setup.mesh.u_el[setup.fixed]
+        setup.u = self.solve(voltages)
+        setup.b_f = setup.sys_ff.dot(setup.u[setup.free])
+        setup.alpha = None
+        return setup
@@ -2,13 +2,273 @@
 Created on 17 Jan 2015
 
 @author: Kristjan
+
+Timing and instrumentation of the pipeline phases
+
+    util.tic('solve')
+    ...
+    util.toc("Solved the equation: %0.2f s", iterations=n)
+
+or, the same as a context manager,
+
+    with util.phase('solve', "Solved the equation: %0.2f s") as ph:
+        ...
+        ph.count(iterations=n)
+
+prints the message when verbose is set and, while hooks are registered
+(a Profiler is active), reports a record of the phase to them:
+{'name', 'thread', 'parent', 'wall' (s), 'cpu' (s, of the process),
+'peak_bytes' (with memory tracking, above the start of the phase, or None),
+'counters'}. Counters are added to the innermost phase of the thread
+(util.count). The phase stack is per thread.
+With no hooks a phase only reads the wall clock.
+
+Long loops report their progress with util.progress(done, total), which
+goes to the Task of the thread (a GUI progress bar) and is where a
+cancelled task stops, by raising Cancelled.
 '''
+import json
+import threading
+import time
+import tracemalloc
+
+verbose = True # print the phase messages and log()
+
+_hooks = []
+_memory = [0] # number of hooks tracking memory
+_local = threading.local()
+_lock = threading.Lock()
+
+def log(*args):
+    if verbose:
+        print(*args)
+
+def add_hook(hook, memory=False):
+    '''
+    hook(record) is called at the end of every phase
+    '''
+    with _lock:
+        _hooks.append(hook)
+        if memory:
+            if _memory[0] == 0 and not tracemalloc.is_tracing():
+                tracemalloc.start()
+            _memory[0] += 1
+
+def remove_hook(hook, memory=False):
+    with _lock:
+        _hooks.remove(hook)
+        if memory:
+            _memory[0] -= 1
+            if _memory[0] == 0:
+                tracemalloc.stop()
+
+def _stack():
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+class Phase(object):
+    __slots__ = ('name', 'fmt', 'counters', 'wall', 'cpu', 'start_bytes',
+                 'peak', 'parent', 'recording')
+
+    def __init__(self, name, fmt=None):
+        self.name = name
+        self.fmt = fmt
+        self.counters = {}
+
+    def __enter__(self):
+        task = getattr(_local, 'task', None)
+        if task is not None:
+            task.report(self.name, 0.0, True)
+        self.recording = bool(_hooks)
+        stack = _stack()
+        self.parent = stack[-1] if stack else None
+        stack.append(self)
+        self.peak = None
+        if self.recording and _memory[0] and tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            if self.parent is not None and self.parent.peak is not None:
+                self.parent.peak = max(self.parent.peak, peak)
+            tracemalloc.reset_peak()
+            self.start_bytes = current
+            self.peak = current
+        if self.recording:
+            self.cpu = time.process_time()
+        self.wall = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.wall = time.perf_counter()-self.wall
+        stack = _stack()
+        # and the tic phases left open inside it by an exception
+        while stack and stack.pop() is not self:
+            pass
+        if verbose and self.fmt:
+            print(self.fmt % self.wall)
+        if self.recording:
+            self.cpu = time.process_time()-self.cpu
+            if self.peak is not None and tracemalloc.is_tracing():
+                self.peak = max(self.peak, tracemalloc.get_traced_memory()[1])
+                if self.parent is not None and self.parent.peak is not None:
+                    self.parent.peak = max(self.parent.peak, self.peak)
+            record = self.record()
+            for hook in list(_hooks):
+                hook(record)
+        return False
+
+    def count(self, **counters):
+        for key, value in counters.items():
+            self.counters[key] = self.counters.get(key, 0)+value
+
+    def record(self):
+        return {'name': self.name, 'thread': threading.current_thread().name,
+                'parent': self.parent.name if self.parent is not None else None,
+                'wall': self.wall, 'cpu': self.cpu,
+                'peak_bytes': self.peak-self.start_bytes if self.peak is not None else None,
+                'counters': dict(self.counters)}
+
+def phase(name, fmt=None):
+    '''
+    Context manager timing the phase name, fmt is the message
+    printed with the wall time
+    '''
+    return Phase(name, fmt)
+
+def count(**counters):
+    '''
+    Adds to the counters of the innermost phase of the thread,
+    nothing is done when no hooks are registered
+    '''
+    if _hooks:
+        stack = _stack()
+        if stack:
+            stack[-1].count(**counters)
+
+class Profiler(object):
+    '''
+    Collects the phase records while active:
+
+        with util.Profiler(memory=True) as prof:
+            ...
+        prof.to_json('profile.json')
+
+    memory: track the peak memory of the phases with tracemalloc
+    (slows down allocations while active)
+    '''
+    def __init__(self, memory=False):
+        self.memory = memory
+        self.records = []
+
+    def __enter__(self):
+        add_hook(self.records.append, self.memory)
+        return self
+
+    def __exit__(self, *exc):
+        remove_hook(self.records.append, self.memory)
+        return False
+
+    def summary(self):
+        '''
+        Totals per phase name: wall, cpu, the largest peak_bytes,
+        the number of calls and the summed counters
+        '''
+        out = {}
+        for r in self.records:
+            s = out.setdefault(r['name'], {'calls': 0, 'wall': 0.0, 'cpu': 0.0,
+                                           'peak_bytes': None, 'counters': {}})
+            s['calls'] += 1
+            s['wall'] += r['wall']
+            s['cpu'] += r['cpu']
+            if r['peak_bytes'] is not None:
+                s['peak_bytes'] = max(s['peak_bytes'] or 0, r['peak_bytes'])
+            for key, value in r['counters'].items():
+                s['counters'][key] = s['counters'].get(key, 0)+value
+        return out
+
+    def to_json(self, path=None):
+        '''
+        The records and the summary as JSON, written to path if given
+        '''
+        text = json.dumps({'records': self.records, 'summary': self.summary()}, indent=1)
+        if path is not None:
+            with open(path, 'w') as f:
+                f.write(text)
+        return text
+
+class Cancelled(Exception):
+    '''
+    Raised by progress() in a cancelled Task
+    '''
+
+class Task(object):
+    '''
+    Reports the progress of the phases run inside it, on the thread
+    that enters it:
+
+        task = util.Task(callback)
+        with task:
+            controller.solve(...)
+
+    callback(name, fraction) is called when a phase starts (fraction 0)
+    and from progress(), at most every interval seconds. task.cancel(),
+    from any thread, makes the next progress() or phase start raise
+    Cancelled
+    '''
+    def __init__(self, callback=None, interval=0.05):
+        self.callback = callback
+        self.interval = interval
+        self.cancelled = False
+        self.last = 0.0
+
+    def cancel(self):
+        self.cancelled = True
+
+    def __enter__(self):
+        self.outer = getattr(_local, 'task', None)
+        self.depth = len(_stack())
+        _local.task = self
+        return self
+
+    def __exit__(self, *exc):
+        _local.task = self.outer
+        # phases started by tic and left open by an exception
+        del _stack()[self.depth:]
+        return False
+
+    def report(self, name, fraction, force=False):
+        if self.cancelled:
+            raise Cancelled()
+        if self.callback is not None:
+            now = time.perf_counter()
+            if force or now-self.last >= self.interval:
+                self.last = now
+                self.callback(name, fraction)
 
-from time import time
-_tstart_stack = []
+def progress(done, total):
+    '''
+    Reports the fraction done/total of the innermost phase to the Task of
+    the thread, nothing is done outside a task
+    '''
+    task = getattr(_local, 'task', None)
+    if task is not None:
+        stack = _stack()
+        task.report(stack[-1].name if stack else None,
+                    min(max(done/total, 0.0), 1.0) if total > 0 else 0.0)
 
-def tic():
-    _tstart_stack.append(time())
+def tic(name=None):
+    '''
+    Starts the phase name, ended by toc. tic/toc pairs nest like phases
+    '''
+    Phase(name).__enter__()
 
-def toc(fmt="Elapsed: %.2f s"):
-    print(fmt % (time() - _tstart_stack.pop()))
\ No newline at end of file
+def toc(fmt="Elapsed: %.2f s", **counters):
+    '''
+    Ends the innermost phase started by tic, adds the counters
+    and prints fmt with the wall time
+    '''
+    p = _stack()[-1]
+    p.fmt = fmt
+    if counters and _hooks:
+        p.count(**counters)
+    p.__exit__(None, None, None)
@@ -0,0 +1,24 @@
+'''
+The error estimate of the adaptive refinement
+'''
+import numpy as np
+
+import fem.util as util
+from fem.adapt import adapt
+from fem.geometry import Geometry
+from fem.mesh import Mesh
+
+util.verbose = False
+
+def test_axisym_same_scale():
+    # far from the axis, 2*pi*r is nearly constant and the axisymmetric
+    # problem is the planar one scaled by it, the relative errors agree
+    geom = Geometry(1000, 1040, -20, 20)
+    geom.add_circular(1012, 0, 4, 1)
+    geom.add_rectangular(1024, -6, 1030, 6, -1)
+    estimates = []
+    for is_axisym in (False, True):
+        mesh = Mesh(geom, 2, 2)
+        mesh.generate_mesh()
+        estimates.append(adapt(mesh, is_axisym, max_steps=0)[1][0][1])
+    assert np.isclose(estimates[1], estimates[0], rtol=0.05)
@@ -0,0 +1,18 @@
+'''
+The demonstration of Controller.start, drawn without a display
+'''
+import pytest
+
+import fem.util as util
+from fem.controller import Controller
+
+util.verbose = False
+
+def test_start(monkeypatch):
+    matplotlib = pytest.importorskip('matplotlib')
+    matplotlib.use('Agg')
+    from fem import render
+    monkeypatch.setattr(render, 'show', lambda: None)
+    controller = Controller()
+    controller.start()
+    assert len(controller.geometry.electrodes) == 1
@@ -0,0 +1,18 @@
+'''
+The numerical core is importable without the plotting and GUI
+libraries, within the import time budget of bench.import_time
+'''
+from bench.import_time import import_time
+
+BUDGET = 2.0 # s for import fem.setup
+OVERHEAD = 0.25 # s over import numpy, scipy.sparse
+
+def test_no_heavy_imports():
+    for module in ('fem.setup', 'fem.controller', 'fem.batch', 'fem.adapt', 'fem.incremental'):
+        assert import_time(module, 1)[1] == '', module
+
+def test_import_budget():
+    base = import_time('numpy, scipy.sparse', 3)[0]
+    t = import_time('fem.setup', 3)[0]
+    assert t < BUDGET
+    assert t-base < OVERHEAD
@@ -0,0 +1,67 @@
+'''
+Incremental re-solve against solving the edited geometry from scratch
+'''
+import numpy as np
+
+import fem.util as util
+from fem import incremental
+from fem.geometry import Geometry
+from fem.mesh import Mesh
+from fem.multigrid import Multigrid
+from fem.setup import Setup
+
+util.verbose = False
+
+def build(geom, method=4, **options):
+    mesh = Mesh(geom, 1, 1)
+    mesh.generate_mesh()
+    setup = Setup(mesh)
+    setup.init_system_mat(False, sparse=True)
+    setup.boundary_conditions()
+    setup.solve(method, **options)
+    return setup
+
+def solved():
+    geom = Geometry(-50, 50, -50, 50)
+    geom.add_circular(-20, 0, 10, 1)
+    geom.add_rectangular(15, -10, 30, 10, -1)
+    return build(geom, precond='mg'), geom
+
+def assert_same(new, edited):
+    # the updated setup matches the edited geometry meshed and solved
+    # from scratch with a direct solver
+    ref = build(edited, 3)
+    assert np.array_equal(new.mesh.coords, ref.mesh.coords)
+    assert np.array_equal(new.mesh.elems, ref.mesh.elems)
+    assert np.array_equal(new.mesh.on_el, ref.mesh.on_el)
+    assert np.array_equal(new.mesh.u_el, ref.mesh.u_el)
+    assert abs(new.sys-ref.sys).max() < 1e-12*abs(ref.sys).max()
+    assert np.allclose(new.u, ref.u, atol=1e-6)
+
+def test_potentials():
+    setup, geom = solved()
+    edited = geom.copy()
+    edited.electrodes[0].u = 5
+    new = incremental.update(setup, geom.to_dict(), edited, False, 4, precond='mg')
+    mesh = new.mesh
+    node = np.flatnonzero(mesh.el_index == 0)[0]
+    assert mesh.nodes[node].u == 5
+    assert setup.mesh.nodes[node].u == 1
+    # the multigrid hierarchy is kept
+    assert new.factor is setup.factor
+    assert_same(new, edited)
+
+def test_moved_electrode():
+    setup, geom = solved()
+    edited = geom.copy()
+    edited.electrodes[0].x += 3.3
+    edited.add_circular(35, 35, 4, 2)
+    new = incremental.update(setup, geom.to_dict(), edited, False, 4, precond='mg')
+    assert_same(new, edited)
+    # the updated hierarchy is the one built for the new mesh
+    rebuilt = Multigrid(new.mesh, new.sys_ff, new.free)
+    assert len(new.factor.levels) == len(rebuilt.levels) > 2
+    for a, b in zip(new.factor.levels, rebuilt.levels):
+        assert abs(a.sys-b.sys).max() < 1e-12*abs(b.sys).max()
+        if b.prolong is not None:
+            assert abs(a.prolong-b.prolong).max() < 1e-12
@@ -0,0 +1,79 @@
+'''
+Mesh.generate_mesh against the point by point generator it replaced
+'''
+import numpy as np
+import pytest
+
+import fem.util as util
+from fem.geometry import Geometry
+from fem.mesh import Mesh
+
+util.verbose = False
+
+def reference_mesh(geometry, x_step, y_step):
+    '''
+    The loop over the grid points of the original generator:
+    coords, elems, on_el and u_el
+    '''
+    nx = int((geometry.x_max-geometry.x_min)/x_step)+2
+    ny = int((geometry.y_max-geometry.y_min)/y_step)+2
+    grid = np.full((nx, ny), -1, dtype=np.int32)
+
+    def is_boundary(x, y):
+        xm, xp, ym, yp = x-x_step, x+x_step, y-y_step, y+y_step
+        g = geometry
+        return (xm >= g.x_min and not g.is_electrode(xm, y)[0] or
+                xp <= g.x_max and not g.is_electrode(xp, y)[0] or
+                ym >= g.y_min and not g.is_electrode(x, ym)[0] or
+                yp <= g.y_max and not g.is_electrode(x, yp)[0] or
+                xp <= g.x_max and yp <= g.y_max and not g.is_electrode(xp, yp)[0] or
+                xm >= g.x_min and ym >= g.y_min and not g.is_electrode(xm, ym)[0])
+
+    coords, on_el, u_el, elems = [], [], [], []
+    for i in range(nx):
+        for j in range(ny):
+            x = i*x_step+geometry.x_min
+            y = j*y_step+geometry.y_min
+            is_el = geometry.is_electrode(x, y)
+            if is_el[0] and not is_boundary(x, y):
+                continue
+            coords.append((x, y))
+            on_el.append(is_el[0])
+            u_el.append(is_el[1])
+            grid[i, j] = len(coords)-1
+            if i <= 0 or j <= 0:
+                continue
+            on00 = on_el[grid[i, j]]
+            on10 = on_el[grid[i-1, j]] if grid[i-1, j] >= 0 else True
+            on01 = on_el[grid[i, j-1]] if grid[i, j-1] >= 0 else True
+            on11 = on_el[grid[i-1, j-1]] if grid[i-1, j-1] >= 0 else True
+            if grid[i, j-1] >= 0 and grid[i-1, j-1] >= 0 and not (on00 and on01 and on11):
+                elems.append((grid[i, j], grid[i-1, j-1], grid[i, j-1]))
+            if grid[i-1, j] >= 0 and grid[i-1, j-1] >= 0 and not (on00 and on10 and on11):
+                elems.append((grid[i, j], grid[i-1, j], grid[i-1, j-1]))
+    return (np.array(coords, dtype=np.float64).reshape(-1, 2), np.array(elems).reshape(-1, 3),
+            np.array(on_el, dtype=bool), np.array(u_el, dtype=np.float64))
+
+def random_geometry(seed):
+    rng = np.random.RandomState(seed)
+    geom = Geometry(-40, 40, -30, 30)
+    for _ in range(rng.randint(1, 6)):
+        u = rng.uniform(-5, 5)
+        if rng.rand() < 0.5:
+            geom.add_circular(rng.uniform(-45, 45), rng.uniform(-35, 35), rng.uniform(1, 15), u)
+        else:
+            x, y = rng.uniform(-45, 45, 2), rng.uniform(-35, 35, 2)
+            geom.add_rectangular(x[0], y[0], x[1], y[1], u)
+    return geom
+
+@pytest.mark.parametrize('seed', range(8))
+@pytest.mark.parametrize('steps', [(1, 1), (1.3, 0.7), (2.5, 2.5)])
+def test_same_as_reference(seed, steps):
+    geom = random_geometry(seed)
+    mesh = Mesh(geom, *steps)
+    mesh.generate_mesh()
+    coords, elems, on_el, u_el = reference_mesh(geom, *steps)
+    assert np.array_equal(mesh.coords, coords)
+    assert np.array_equal(mesh.on_el, on_el)
+    assert np.array_equal(mesh.u_el, u_el)
+    assert np.array_equal(mesh.elems, elems)
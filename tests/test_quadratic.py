@@ -0,0 +1,46 @@
+'''
+Quadratic (P2) elements
+'''
+import numpy as np
+
+import fem.util as util
+from fem.geometry import Geometry
+from fem.mesh import Mesh
+from fem.quadratic import QuadraticMesh, QuadraticSetup
+
+util.verbose = False
+
+def setup():
+    geom = Geometry(0, 20, 0, 16)
+    geom.add_circular(6, 8, 2, 1)
+    geom.add_rectangular(12, 5, 15, 11, -1)
+    mesh = Mesh(geom, 1, 1)
+    mesh.generate_mesh()
+    return QuadraticSetup(QuadraticMesh(mesh))
+
+def test_nodal_gradients_linear():
+    # the gradient of a linear potential is recovered exactly at the
+    # vertices and at the middles of the edges
+    s = setup()
+    x, y = s.mesh.coords.T
+    s.u = 3*x - 2*y + 1
+    grad = s.nodal_gradients()
+    assert grad.shape == (len(s.mesh.coords), 2)
+    assert np.allclose(grad, [3, -2])
+
+def test_nodal_gradients_quadratic():
+    # a quadratic potential is exact in the P2 space, so is its gradient
+    s = setup()
+    x, y = s.mesh.coords.T
+    s.u = x**2 - x*y + 2*y
+    grad = s.nodal_gradients()
+    assert np.allclose(grad, np.column_stack((2*x - y, 2 - x)))
+
+def test_nodal_gradients_solved():
+    s = setup()
+    s.init_system_mat(False, sparse=True)
+    s.boundary_conditions()
+    s.solve(3)
+    grad = s.nodal_gradients()
+    assert grad.shape == (len(s.mesh.coords), 2)
+    assert np.all(np.isfinite(grad))
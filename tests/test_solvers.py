@@ -0,0 +1,87 @@
+'''
+The solution of every solver and matrix storage against the full system
+with the Dirichlet rows replaced, the elimination of the original code
+'''
+import numpy as np
+import pytest
+import scipy.sparse as sp
+import scipy.sparse.linalg as spla
+
+import fem.pcg as pcg
+import fem.util as util
+from fem.controller import Controller
+from fem.geometry import Geometry
+from fem.mesh import Mesh, graded_lines
+from fem.setup import Setup
+
+util.verbose = False
+
+def geometry(is_axisym):
+    if is_axisym:
+        geom = Geometry(0, 40, -20, 20)
+        geom.add_rectangular(0, -12, 2, 12, 1)
+        geom.add_circular(20, 0, 5, -2)
+    else:
+        geom = Geometry(-20, 20, -20, 20)
+        geom.add_circular(-8, 0, 5, 1)
+        geom.add_rectangular(6, -4, 12, 6, -2)
+    return geom
+
+def reference(mesh, is_axisym):
+    '''
+    The assembled matrix with the rows of the electrode nodes
+    replaced by the identity, solved by sparse LU
+    '''
+    setup = Setup(mesh)
+    setup.init_system_mat(is_axisym, sparse=True)
+    sys = setup.sys.tolil()
+    b = np.zeros(len(mesh.coords))
+    for k in np.flatnonzero(mesh.on_el):
+        sys.rows[k] = [k]
+        sys.data[k] = [1.0]
+        b[k] = mesh.u_el[k]
+    return spla.spsolve(sp.csc_matrix(sys), b)
+
+@pytest.mark.parametrize('is_axisym', [False, True])
+@pytest.mark.parametrize('solver', Controller.solvers, ids=[s[0] for s in Controller.solvers])
+def test_solver(solver, is_axisym):
+    name, storage, method, options = solver
+    # the pure python elimination only on a coarse grid
+    step = 4 if method == 1 else 1
+    mesh = Mesh(geometry(is_axisym), step, step)
+    mesh.generate_mesh()
+    setup = Setup(mesh)
+    setup.init_system_mat(is_axisym, storage != 'dense', storage == 'matrix-free')
+    setup.boundary_conditions()
+    setup.solve(method, **options)
+    expected = reference(mesh, is_axisym)
+    assert np.allclose(setup.u, expected, rtol=0, atol=1e-5)
+    assert np.array_equal(setup.u[mesh.on_el], mesh.u_el[mesh.on_el])
+
+def test_graded_multigrid():
+    # the V-cycles alone stall on a graded grid, method 5 still converges
+    geom = geometry(False)
+    x = graded_lines(-20, 20, [(-13, -3), (6, 12)], 0.25, 2)
+    y = graded_lines(-20, 20, [(-5, 6)], 0.25, 2)
+    mesh = Mesh(geom, x=x, y=y)
+    mesh.generate_mesh()
+    setup = Setup(mesh)
+    setup.init_system_mat(False, sparse=True)
+    setup.boundary_conditions()
+    setup.solve(5)
+    assert setup.residuals[-1] < 1e-8
+    assert np.allclose(setup.u, reference(mesh, False), rtol=0, atol=1e-5)
+
+def test_multigrid_not_converged():
+    mesh = Mesh(geometry(False), 1, 1)
+    mesh.generate_mesh()
+    setup = Setup(mesh)
+    setup.init_system_mat(False, sparse=True)
+    setup.boundary_conditions()
+    with pytest.raises(ValueError):
+        setup.solve(5, maxiter=2)
+
+def test_ic0_not_spd():
+    mat = sp.csr_matrix(np.array([[4.0, 1.0, 0.0], [1.0, -2.0, 1.0], [0.0, 1.0, 4.0]]))
+    with pytest.raises(ValueError, match='positive definite'):
+        pcg.IncompleteCholesky(mat)
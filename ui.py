@@ -7,8 +7,36 @@ Created on 23 Jan 2015
 from PySide.QtCore import *
 from PySide.QtGui import *
 
+import fem.util as util
 from fem.controller import Controller
 
+# progress bar text of the pipeline phases
+STAGES = {'mesh': "Generating mesh", 'assemble': "Assembling the system",
+          'boundary': "Boundary conditions", 'solve': "Solving", 'sweep': "Sweep basis"}
+
+class Worker(QThread):
+    '''
+    Runs a Controller call on its own thread inside a util.Task,
+    the progress of its phases is sent by the progress signal.
+    The exception it raised, if any, is kept in self.error
+    '''
+    progress = Signal(str, float)
+    
+    def __init__(self, fn, parent=None):
+        super(Worker, self).__init__(parent)
+        self.fn = fn
+        self.task = util.Task(lambda name, fraction: self.progress.emit(str(name), fraction))
+        self.error = None
+    
+    def run(self):
+        try:
+            with self.task:
+                self.fn()
+        except util.Cancelled:
+            pass
+        except Exception as e:
+            self.error = e
+
 class UI(QWidget):
     def __init__(self, controller, parent=None):
         super(UI, self).__init__(parent)
@@ -17,6 +45,8 @@ class UI(QWidget):
         
         self.h1_font = QFont("Arial", 10, QFont.Bold)
         
+        self.init_progress()
+        
         main_layout = QGridLayout()
         
         self.init_geometry()
@@ -28,10 +58,78 @@ class UI(QWidget):
         self.init_solver()
         main_layout.addLayout(self.solver_layout, 1, 1)
         
+        main_layout.addLayout(self.progress_layout, 3, 0, 1, 2)
+        
         self.setLayout(main_layout)
         self.setWindowTitle("FEM electric field modelling")
         
     
+    def init_progress(self):
+        self.worker = None
+        self.run_buttons = []
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setRange(0, 1000)
+        self.progress_bar.setFormat("Idle")
+        self.progress_bar.setValue(0)
+        self.cancel = QPushButton("Cancel")
+        self.cancel.setEnabled(False)
+        self.cancel.clicked.connect(self.cancel_work)
+        
+        self.progress_layout = QGridLayout()
+        self.progress_layout.addWidget(self.progress_bar, 0, 0)
+        self.progress_layout.addWidget(self.cancel, 0, 1)
+    
+    def run(self, fn):
+        '''
+        Runs fn on a worker thread, the buttons starting computations are
+        disabled meanwhile. Drawing and probing use the last mesh and solution
+        '''
+        if self.worker is not None:
+            return
+        self.worker = Worker(fn, self)
+        self.worker.progress.connect(self.show_progress)
+        self.worker.finished.connect(self.work_done)
+        for button in self.run_buttons:
+            button.setEnabled(False)
+        self.cancel.setEnabled(True)
+        self.progress_bar.setValue(0)
+        self.progress_bar.setFormat("Starting")
+        self.worker.start()
+    
+    def show_progress(self, name, fraction):
+        self.progress_bar.setFormat("%s: %%p%%" % STAGES.get(name, name))
+        self.progress_bar.setValue(int(fraction*1000))
+    
+    def cancel_work(self):
+        if self.worker is not None:
+            self.worker.task.cancel()
+            self.progress_bar.setFormat("Cancelling")
+    
+    def work_done(self):
+        worker = self.worker
+        self.worker = None
+        for button in self.run_buttons:
+            button.setEnabled(True)
+        self.cancel.setEnabled(False)
+        if worker.task.cancelled:
+            self.progress_bar.setFormat("Cancelled")
+        elif worker.error is not None:
+            self.progress_bar.setFormat("Failed")
+            if isinstance(worker.error, AttributeError):
+                QMessageBox.information(self, "Attribute error",
+                                        "Generate the mesh first.")
+            else:
+                QMessageBox.information(self, "Error", str(worker.error))
+        else:
+            self.progress_bar.setFormat("Done")
+            self.progress_bar.setValue(1000)
+    
+    def closeEvent(self, event):
+        if self.worker is not None:
+            self.worker.task.cancel()
+            self.worker.wait()
+        event.accept()
+    
     def init_geometry(self):
         geom_heading = QLabel("Geometry")
         geom_heading.setFont(self.h1_font)
@@ -180,8 +278,9 @@ class UI(QWidget):
         gen_mesh = QPushButton("Generate mesh")
         gen_mesh.setMaximumHeight(100);
         gen_mesh.clicked.connect(lambda: self.generate_mesh(xstep.text(), ystep.text()))
+        self.run_buttons.append(gen_mesh)
         
-        draw_elem = QCheckBox("Draw elem. lines (slow)")
+        draw_elem = QCheckBox("Draw elem. lines")
         draw_mesh = QPushButton("Draw mesh")
         draw_mesh.clicked.connect(lambda: self.draw_mesh(draw_elem.isChecked()))
         
@@ -197,10 +296,13 @@ class UI(QWidget):
         
     def generate_mesh(self, xstep, ystep):
         try:
-            self.controller.generate_mesh(float(xstep), float(ystep))
+            xstep = float(xstep)
+            ystep = float(ystep)
         except ValueError:
             QMessageBox.information(self, "Input error",
                                     "The input format is incorrect.")
+            return
+        self.run(lambda: self.controller.generate_mesh(xstep, ystep))
     
     def draw_mesh(self, elem_lines):
         nodes_only = not elem_lines
@@ -216,12 +318,15 @@ class UI(QWidget):
         
         desc = QLabel("Solver type and system matrix storage:")
         solver_select = QComboBox()
-        solver_select.addItems(['Numpy/Numpy matrix', 'Gaussian el./Numpy matrix',
-                                'Gaussian el./skyline storage (not impl.)'])
+        solver_select.addItems(self.controller.solver_names())
         
         solve = QPushButton("Solve")
-        solve.clicked.connect(lambda: self.controller.solve(self.type_select.currentIndex(),
-                                                            solver_select.currentIndex()))
+        solve.clicked.connect(lambda: self.solve(solver_select.currentIndex()))
+        update = QPushButton("Update solution")
+        update.setToolTip("Solve again after changing the electrodes, updating\n"
+                          "only the changed part of the mesh and matrix")
+        update.clicked.connect(lambda: self.update_solution(solver_select.currentIndex()))
+        self.run_buttons += [solve, update]
         
         with_nodes = QCheckBox("Draw mesh nodes")
         with_geom = QCheckBox("Draw geometry")
@@ -255,11 +360,20 @@ class UI(QWidget):
         self.solver_layout.addWidget(desc, 1, 0)
         self.solver_layout.addWidget(solver_select, 1, 1)
         self.solver_layout.addWidget(solve, 2, 0)
+        self.solver_layout.addWidget(update, 2, 1)
         self.solver_layout.addWidget(with_nodes, 3, 0)
         self.solver_layout.addWidget(with_geom, 4, 0)
         self.solver_layout.addWidget(draw_sol, 5, 0, 1, 2)
         self.solver_layout.addLayout(probe_layout, 6, 0, 2, 2)
         
+    def solve(self, method_index):
+        geom_type = self.type_select.currentIndex()
+        self.run(lambda: self.controller.solve(geom_type, method_index))
+    
+    def update_solution(self, method_index):
+        geom_type = self.type_select.currentIndex()
+        self.run(lambda: self.controller.resolve(geom_type, method_index))
+    
     def probe_value(self, x, y):
         try:
             self.val.setText(str(self.controller.probe_value(float(x), float(y))))